@@ -1,6 +1,5 @@
 import os
-import shutil
-from typing import List, Optional
+from typing import Any, Optional
 
 from auxiliary.nifti.io import read_nifti, write_nifti
 from auxiliary.normalization.normalizer_base import Normalizer
@@ -8,6 +7,7 @@ from auxiliary.turbopath import turbopath
 
 from brainles_preprocessing.brain_extraction.brain_extractor import BrainExtractor
 from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import copy_nifti
 
 
 class Modality:
@@ -127,7 +127,7 @@ class Modality:
         # Backup the unnormalized file
         if store_unnormalized is not None:
             os.makedirs(store_unnormalized, exist_ok=True)
-            shutil.copyfile(
+            copy_nifti(
                 src=self.current,
                 dst=f"{store_unnormalized}/unnormalized__{self.modality_name}.nii.gz",
             )
@@ -135,7 +135,7 @@ class Modality:
         if temporary_directory is not None:
             unnormalized_dir = f"{temporary_directory}/unnormalized"
             os.makedirs(unnormalized_dir, exist_ok=True)
-            shutil.copyfile(
+            copy_nifti(
                 src=self.current,
                 dst=f"{unnormalized_dir}/unnormalized__{self.modality_name}.nii.gz",
             )
@@ -156,6 +156,8 @@ class Modality:
         fixed_image_path: str,
         registration_dir: str,
         moving_image_name: str,
+        fixed_image: Optional[Any] = None,
+        file_suffix: str = ".nii.gz",
     ) -> str:
         """
         Register the current modality to a fixed image using the specified registrator.
@@ -165,23 +167,35 @@ class Modality:
             fixed_image_path (str): Path to the fixed image.
             registration_dir (str): Directory to store registration results.
             moving_image_name (str): Name of the moving image.
+            fixed_image (Any, optional): The fixed image as returned by `registrator.preload_image`.
+            file_suffix (str, optional): File extension of the registered image, defaults to ".nii.gz".
 
         Returns:
             str: Path to the registration matrix.
         """
-        registered = os.path.join(registration_dir, f"{moving_image_name}.nii.gz")
+        registered = os.path.join(registration_dir, f"{moving_image_name}{file_suffix}")
         registered_matrix = os.path.join(
             registration_dir, f"{moving_image_name}"
         )  # note, add file ending depending on registration backend!
         registered_log = os.path.join(registration_dir, f"{moving_image_name}.log")
 
-        registrator.register(
-            fixed_image_path=fixed_image_path,
-            moving_image_path=self.current,
-            transformed_image_path=registered,
-            matrix_path=registered_matrix,
-            log_file_path=registered_log,
-        )
+        if fixed_image is not None:
+            registrator.register_preloaded(
+                fixed_image=fixed_image,
+                fixed_image_path=fixed_image_path,
+                moving_image_path=self.current,
+                transformed_image_path=registered,
+                matrix_path=registered_matrix,
+                log_file_path=registered_log,
+            )
+        else:
+            registrator.register(
+                fixed_image_path=fixed_image_path,
+                moving_image_path=self.current,
+                transformed_image_path=registered,
+                matrix_path=registered_matrix,
+                log_file_path=registered_log,
+            )
         self.current = registered
         return registered_matrix
 
@@ -221,6 +235,8 @@ class Modality:
         registration_dir_path: str,
         moving_image_name: str,
         transformation_matrix_path: str,
+        file_suffix: str = ".nii.gz",
+        fixed_image: Optional[Any] = None,
     ) -> None:
         """
         Transform the current modality using the specified registrator and transformation matrix.
@@ -231,22 +247,36 @@ class Modality:
             registration_dir_path (str): Directory to store transformation results.
             moving_image_name (str): Name of the moving image.
             transformation_matrix_path (str): Path to the transformation matrix.
+            file_suffix (str, optional): File extension of the transformed image, defaults to ".nii.gz".
+            fixed_image (Any, optional): The fixed image as returned by `registrator.preload_image`.
 
         Returns:
             None
         """
-        transformed = os.path.join(registration_dir_path, f"{moving_image_name}.nii.gz")
+        transformed = os.path.join(
+            registration_dir_path, f"{moving_image_name}{file_suffix}"
+        )
         transformed_log = os.path.join(
             registration_dir_path, f"{moving_image_name}.log"
         )
 
-        registrator.transform(
-            fixed_image_path=fixed_image_path,
-            moving_image_path=self.current,
-            transformed_image_path=transformed,
-            matrix_path=transformation_matrix_path,
-            log_file_path=transformed_log,
-        )
+        if fixed_image is not None:
+            registrator.transform_preloaded(
+                fixed_image=fixed_image,
+                fixed_image_path=fixed_image_path,
+                moving_image_path=self.current,
+                transformed_image_path=transformed,
+                matrix_path=transformation_matrix_path,
+                log_file_path=transformed_log,
+            )
+        else:
+            registrator.transform(
+                fixed_image_path=fixed_image_path,
+                moving_image_path=self.current,
+                transformed_image_path=transformed,
+                matrix_path=transformation_matrix_path,
+                log_file_path=transformed_log,
+            )
         self.current = transformed
 
     def extract_brain_region(
@@ -290,9 +320,9 @@ class Modality:
         os.makedirs(output_path.parent, exist_ok=True)
 
         if normalization is False:
-            shutil.copyfile(
-                self.current,
-                output_path,
+            copy_nifti(
+                src=self.current,
+                dst=output_path,
             )
         elif normalization is True:
             image = read_nifti(self.current)
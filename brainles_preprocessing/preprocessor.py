@@ -1,8 +1,7 @@
-from functools import wraps
+from functools import cached_property, wraps
 import logging
 import os
 from pathlib import Path
-import shutil
 import signal
 import subprocess
 import sys
@@ -16,10 +15,29 @@ from auxiliary.turbopath import turbopath
 from .brain_extraction.brain_extractor import BrainExtractor
 from .modality import Modality
 from .registration.registrator import Registrator
+from .utils import fast_copy, gzip_copy
 
 logger = logging.getLogger(__name__)
 
 
+def ensure_remove_log_file_handler(func):
+    """
+    Decorator for `Preprocessor` methods that detaches and closes the run's log file handler once the method returns or raises.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            if self.log_file_handler:
+                logging.getLogger().removeHandler(self.log_file_handler)
+                self.log_file_handler.close()
+                self.log_file_handler = None
+
+    return wrapper
+
+
 class Preprocessor:
     """
     Preprocesses medical image modalities using coregistration, normalization, brain extraction, and more.
@@ -33,9 +51,13 @@ class Preprocessor:
         temp_folder (str, optional): Path to a temporary folder for storing intermediate results.
         use_gpu (Optional[bool]): Use GPU for processing if True, CPU if False, or automatically detect if None.
         limit_cuda_visible_devices (Optional[str]): Limit CUDA visible devices to a specific GPU ID.
+        compression_level (int, optional): gzip level (1-9) of the ".nii.gz" outputs compressed when they are saved. Defaults to 6.
 
     """
 
+    # intermediate images are read again right away, so they are not compressed
+    _intermediate_suffix = ".nii"
+
     def __init__(
         self,
         center_modality: Modality,
@@ -47,6 +69,7 @@ class Preprocessor:
         temp_folder: Optional[str] = None,
         use_gpu: Optional[bool] = None,
         limit_cuda_visible_devices: Optional[str] = None,
+        compression_level: int = 6,
     ):
         self._setup_logger()
 
@@ -55,6 +78,8 @@ class Preprocessor:
         self.atlas_image_path = turbopath(atlas_image_path)
         self.registrator = registrator
         self.brain_extractor = brain_extractor
+        self.compression_level = compression_level
+        self._check_for_name_conflicts()
 
         self._configure_gpu(
             use_gpu=use_gpu, limit_cuda_visible_devices=limit_cuda_visible_devices
@@ -65,11 +90,36 @@ class Preprocessor:
             os.makedirs(temp_folder, exist_ok=True)
             self.temp_folder = turbopath(temp_folder)
         else:
-            storage = tempfile.TemporaryDirectory()
-            self.temp_folder = turbopath(storage.name)
+            # keep a reference, the directory is removed once the handle is garbage collected
+            self._temp_storage = tempfile.TemporaryDirectory()
+            self.temp_folder = turbopath(self._temp_storage.name)
+
+        # create all stage directories once instead of in every run
+        self._dirs = {}
+        for sub in (
+            "coregistration",
+            "atlas-space",
+            "atlas-correction",
+            "brain-extraction",
+            "brain-extraction/brain_masked",
+        ):
+            self._dirs[sub] = os.path.join(self.temp_folder, sub)
+            os.makedirs(self._dirs[sub], exist_ok=True)
+        self.atlas_dir = self._dirs["atlas-space"]
+
+    def _check_for_name_conflicts(self):
+        """
+        Ensure all modalities have unique names, as the names are used to build intermediate file names.
 
-        self.atlas_dir = os.path.join(self.temp_folder, "atlas-space")
-        os.makedirs(self.atlas_dir, exist_ok=True)
+        Raises:
+            ValueError: If two modalities share the same name.
+        """
+        seen = set()
+        for modality in self.all_modalities:
+            name = modality.modality_name
+            if name in seen:
+                raise ValueError(f"Duplicate modality name: {name}")
+            seen.add(name)
 
     def _configure_gpu(
         self, use_gpu: Optional[bool], limit_cuda_visible_devices: Optional[str] = None
@@ -104,18 +154,6 @@ class Preprocessor:
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
-    def ensure_remove_log_file_handler(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            try:
-                return func(*args, **kwargs)
-            finally:
-                self = args[0]
-                if isinstance(self, Preprocessor) and self.log_file_handler:
-                    logging.getLogger().removeHandler(self.log_file_handler)
-
-        return wrapper
-
     def _set_log_file(self, log_file: Optional[str | Path]) -> None:
         """Set the log file and remove the file handler from a potential previous run.
 
@@ -124,6 +162,7 @@ class Preprocessor:
         """
         if self.log_file_handler:
             logging.getLogger().removeHandler(self.log_file_handler)
+            self.log_file_handler.close()
 
         # ensure parent directories exists
         log_file = Path(
@@ -180,8 +219,13 @@ class Preprocessor:
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
 
-    @property
-    def all_modalities(self):
+    @cached_property
+    def all_modalities(self) -> List[Modality]:
+        """
+        The center modality followed by all moving modalities.
+
+        The list is built once, modifying `moving_modalities` after initialization is not supported.
+        """
         return [self.center_modality] + self.moving_modalities
 
     @ensure_remove_log_file_handler
@@ -223,11 +267,12 @@ class Preprocessor:
         logger.info(f"{' Starting Coregistration ':-^80}")
 
         # Coregister moving modalities to center modality
-        coregistration_dir = os.path.join(self.temp_folder, "coregistration")
-        os.makedirs(coregistration_dir, exist_ok=True)
+        coregistration_dir = self._dirs["coregistration"]
         logger.info(
             f"Coregistering {len(self.moving_modalities)} moving modalities to center modality..."
         )
+        # decode the center modality only once for all moving modalities (if the backend supports it)
+        fixed_image = self.registrator.preload_image(self.center_modality.current)
         for moving_modality in self.moving_modalities:
             file_name = f"co__{self.center_modality.modality_name}__{moving_modality.modality_name}"
             logger.info(
@@ -238,9 +283,11 @@ class Preprocessor:
                 fixed_image_path=self.center_modality.current,
                 registration_dir=coregistration_dir,
                 moving_image_name=file_name,
+                fixed_image=fixed_image,
+                file_suffix=self._intermediate_suffix,
             )
 
-        shutil.copyfile(
+        fast_copy(
             src=self.center_modality.input_path,
             dst=os.path.join(
                 coregistration_dir,
@@ -265,6 +312,7 @@ class Preprocessor:
             fixed_image_path=self.atlas_image_path,
             registration_dir=self.atlas_dir,
             moving_image_name=center_file_name,
+            file_suffix=self._intermediate_suffix,
         )
         logger.info(f"Atlas registration complete. Output saved to {self.atlas_dir}")
 
@@ -272,6 +320,8 @@ class Preprocessor:
         logger.info(
             f"Transforming {len(self.moving_modalities)} moving modalities to atlas space..."
         )
+        # all moving modalities share the atlas and the transformation matrix
+        atlas_image = self.registrator.preload_image(self.atlas_image_path)
         for moving_modality in self.moving_modalities:
             moving_file_name = f"atlas__{moving_modality.modality_name}"
             logger.info(
@@ -283,6 +333,8 @@ class Preprocessor:
                 registration_dir_path=self.atlas_dir,
                 moving_image_name=moving_file_name,
                 transformation_matrix_path=transformation_matrix,
+                file_suffix=self._intermediate_suffix,
+                fixed_image=atlas_image,
             )
         self._save_output(
             src=self.atlas_dir,
@@ -294,8 +346,12 @@ class Preprocessor:
 
         # Optional: additional correction in atlas space
         logger.info(f"{' Checking optional atlas correction ':-^80}")
-        atlas_correction_dir = os.path.join(self.temp_folder, "atlas-correction")
-        os.makedirs(atlas_correction_dir, exist_ok=True)
+        atlas_correction_dir = self._dirs["atlas-correction"]
+        fixed_image = (
+            self.registrator.preload_image(self.center_modality.current)
+            if any(modality.atlas_correction for modality in self.moving_modalities)
+            else None
+        )
 
         for moving_modality in self.moving_modalities:
             if moving_modality.atlas_correction:
@@ -308,16 +364,18 @@ class Preprocessor:
                     fixed_image_path=self.center_modality.current,
                     registration_dir=atlas_correction_dir,
                     moving_image_name=moving_file_name,
+                    fixed_image=fixed_image,
+                    file_suffix=self._intermediate_suffix,
                 )
             else:
                 logger.info("Skipping optional atlas correction.")
 
         if self.center_modality.atlas_correction:
-            shutil.copyfile(
+            fast_copy(
                 src=self.center_modality.current,
                 dst=os.path.join(
                     atlas_correction_dir,
-                    f"atlas_corrected__{self.center_modality.modality_name}.nii.gz",
+                    f"atlas_corrected__{self.center_modality.modality_name}{self._intermediate_suffix}",
                 ),
             )
             logger.info(
@@ -349,10 +407,8 @@ class Preprocessor:
 
         if brain_extraction:
             logger.info("Starting brain extraction...")
-            bet_dir = os.path.join(self.temp_folder, "brain-extraction")
-            os.makedirs(bet_dir, exist_ok=True)
-            brain_masked_dir = os.path.join(bet_dir, "brain_masked")
-            os.makedirs(brain_masked_dir, exist_ok=True)
+            bet_dir = self._dirs["brain-extraction"]
+            brain_masked_dir = self._dirs["brain-extraction/brain_masked"]
             logger.info("Extracting brain region for center modality...")
             atlas_mask = self.center_modality.extract_brain_region(
                 brain_extractor=self.brain_extractor, bet_dir_path=bet_dir
@@ -399,8 +455,18 @@ class Preprocessor:
     ):
         if save_dir is not None:
             save_dir = turbopath(save_dir)
-            shutil.copytree(
-                src=src,
-                dst=save_dir,
-                dirs_exist_ok=True,
-            )
+            os.makedirs(save_dir, exist_ok=True)
+            with os.scandir(src) as entries:
+                for entry in entries:
+                    dst = os.path.join(save_dir, entry.name)
+                    if entry.is_dir():
+                        self._save_output(src=entry.path, save_dir=dst)
+                    elif entry.name.endswith(".nii"):
+                        # only the final deliverables are compressed
+                        gzip_copy(
+                            src=entry.path,
+                            dst=f"{dst}.gz",
+                            compresslevel=self.compression_level,
+                        )
+                    else:
+                        fast_copy(src=entry.path, dst=dst)
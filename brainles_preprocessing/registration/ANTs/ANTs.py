@@ -1,12 +1,116 @@
 # TODO add typing and docs
 import datetime
+import functools
 import os
 import shutil
+import subprocess
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from typing import Optional, Tuple
 
 import ants
-from auxiliary.turbopath import turbopath
-
+import nibabel as nib
+import numpy as np
+
+from brainles_preprocessing.registration._threadconfig import (
+    ITK_THREADS_ENV,
+    set_default_itk_threads,
+    set_itk_threads,
+)
 from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import check_input_files, gzip_copy
+
+# volumes up to this edge length skip the coarse levels of the rigid multi-resolution pyramid
+SMALL_VOLUME_MAX_SHAPE = 128
+SMALL_VOLUME_RIGID_PARAMS = {
+    "aff_shrink_factors": (2, 1),
+    "aff_iterations": (100, 50),
+    "aff_smoothing_sigmas": (1, 0),
+}
+
+# compressed inputs above this size are decompressed with pigz (if installed) before reading
+PIGZ_MIN_INPUT_BYTES = 50 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_image_read(path: str, mtime_ns: int, size: int) -> ants.ANTsImage:
+    # mtime and size are only part of the cache key, so files changed on disk are read again.
+    # ANTs operations return new images, the cached ones are never modified in place.
+    return _fast_image_read(path)
+
+
+def _fast_image_read(path: str) -> ants.ANTsImage:
+    """
+    Read an image, bypassing ITK's NIfTI reader for uncompressed ".nii" files.
+
+    The data is memory-mapped with nibabel and wrapped with `ants.from_numpy`. Compressed files and
+    headers for which nibabel and ITK could derive different geometries fall back to `ants.image_read`.
+
+    Large ".nii.gz" files are decompressed to a temporary ".nii" with pigz if it is installed,
+    which is faster than the single-threaded zlib inflate of ITK.
+
+    Args:
+        path (str): Path to the image.
+
+    Returns:
+        ants.ANTsImage: The image with float pixel type, as returned by `ants.image_read`.
+    """
+    path = str(path)
+    if path.endswith(".nii.gz") and os.path.getsize(path) > PIGZ_MIN_INPUT_BYTES:
+        pigz = shutil.which("pigz")
+        if pigz:
+            fd, uncompressed_path = tempfile.mkstemp(suffix=".nii")
+            try:
+                with os.fdopen(fd, "wb") as uncompressed:
+                    subprocess.run([pigz, "-dc", path], stdout=uncompressed, check=True)
+                # the image data is copied into ITK, so the temporary file can be removed afterwards
+                return _fast_image_read(uncompressed_path)
+            finally:
+                os.remove(uncompressed_path)
+    if path.endswith(".nii"):
+        image = nib.load(path, mmap=True)
+        header = image.header
+        sform_code, qform_code = int(header["sform_code"]), int(header["qform_code"])
+        if (
+            len(image.shape) == 3
+            and (sform_code > 0 or qform_code > 0)
+            and (
+                sform_code == 0
+                or qform_code == 0
+                or np.allclose(header.get_sform(), header.get_qform(), atol=1e-4)
+            )
+        ):
+            affine = image.affine
+            spacing = np.asarray(header.get_zooms()[:3], dtype=np.float64)
+            # NIfTI world coordinates are RAS+, ITK/ANTs use LPS+
+            ras_to_lps = np.diag([-1.0, -1.0, 1.0])
+            direction = ras_to_lps @ affine[:3, :3] / spacing
+            if np.allclose(direction @ direction.T, np.eye(3), atol=1e-4):
+                return ants.from_numpy(
+                    np.asarray(image.dataobj, dtype=np.float32),
+                    origin=tuple(ras_to_lps @ affine[:3, 3]),
+                    spacing=tuple(spacing),
+                    direction=direction,
+                )
+    return ants.image_read(path)
+
+
+_itk_warmed_up = False
+
+
+def _warm_up_itk() -> None:
+    """Run a tiny multithreaded ITK filter once per process, so ITK's thread pool is set up before the first real registration."""
+    global _itk_warmed_up
+    if _itk_warmed_up:
+        return
+    ants.resample_image(
+        ants.from_numpy(np.zeros((8, 8, 8), dtype="float32")),
+        (2, 2, 2),
+        use_voxels=False,
+    )
+    _itk_warmed_up = True
 
 
 class ANTsRegistrator(Registrator):
@@ -14,6 +118,10 @@ class ANTsRegistrator(Registrator):
         self,
         registration_params: dict = None,
         transformation_params: dict = None,
+        num_threads: Optional[int] = None,
+        compression_level: int = 6,
+        use_pigz: bool = False,
+        downsample_spacing: Optional[float] = None,
     ):
         """
         Initialize an ANTsRegistrator instance.
@@ -23,6 +131,14 @@ class ANTsRegistrator(Registrator):
           Defaults to None, which implies using default registration parameters with a rigid transformation.
         - transformation_params (dict, optional): Dictionary of parameters for the transformation method.
           Defaults to an empty dictionary.
+        - num_threads (int, optional): Number of threads used by ITK. Defaults to None, which keeps an
+          already set ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS and otherwise uses min(6, cpu count).
+          ITK picks up the thread count once, before the first registration in the process.
+        - compression_level (int, optional): gzip level (1-9) for ".nii.gz" outputs. Defaults to 6.
+        - use_pigz (bool, optional): Compress ".nii.gz" outputs with all cores using pigz if it is installed.
+          Defaults to False.
+        - downsample_spacing (float, optional): Isotropic spacing (mm) both images are resampled to before
+          registration. The warped output is still produced at full resolution. Defaults to None (no resampling).
 
         The registration_params dictionary may include the following keys:
         - type_of_transform (str, optional): Type of transformation to use (default is "Rigid").
@@ -39,6 +155,73 @@ class ANTsRegistrator(Registrator):
         # Set default transformation parameters
         self.transformation_params = transformation_params or {}
 
+        self.compression_level = compression_level
+        self.use_pigz = use_pigz
+        self.downsample_spacing = downsample_spacing
+
+        self._configure_threads(num_threads=num_threads)
+
+    @staticmethod
+    def warm_up() -> None:
+        """
+        Set up ITK's thread pool with a tiny filter, so the first registration does not pay for it.
+
+        ITK fixes its thread count at this point, so a `num_threads` passed to later registrators has no effect.
+        """
+        _warm_up_itk()
+
+    @staticmethod
+    def _configure_threads(num_threads: Optional[int]) -> None:
+        """
+        Set the ITK thread count through its environment variable.
+
+        Args:
+            num_threads (int, optional): Requested number of threads, None to keep an existing setting
+                (or to use the default limit if there is none).
+        """
+        if num_threads is None:
+            set_default_itk_threads()
+            return
+
+        configured = os.environ.get(ITK_THREADS_ENV)
+        if _itk_warmed_up and configured != str(num_threads):
+            warnings.warn(
+                f"ITK already runs with {ITK_THREADS_ENV}={configured} in this process, "
+                f"num_threads={num_threads} will not take effect.",
+                RuntimeWarning,
+            )
+        set_itk_threads(num_threads)
+
+    def preload_image(self, image_path: str) -> ants.ANTsImage:
+        """
+        Read an image once so it can be shared by several registrations.
+
+        Recently read images are cached (keyed by path, modification time and size),
+        so repeatedly registering against the same fixed image, e.g. an atlas, decodes it only once.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            ants.ANTsImage: The decoded image, to be passed to `register_preloaded`.
+        """
+        stat = os.stat(image_path)
+        return _cached_image_read(str(image_path), stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def clear_image_cache(cls) -> None:
+        """Drop all images cached by `preload_image`."""
+        _cached_image_read.cache_clear()
+
+    def matrix_file_path(self, matrix_path: str) -> str:
+        return _with_mat_suffix(matrix_path)
+
+    def registration_settings(self) -> Tuple:
+        return (
+            tuple(sorted(self.registration_params.items())),
+            self.downsample_spacing,
+        )
+
     def register(
         self,
         fixed_image_path: str,
@@ -59,30 +242,111 @@ class ANTsRegistrator(Registrator):
             log_file_path (str): Path to the log file.
             **kwargs: Additional registration parameters to update the instantiated defaults.
         """
-        # we update the transformation parameters with the provided kwargs
+        self.register_preloaded(
+            fixed_image=self.preload_image(fixed_image_path),
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+            **kwargs,
+        )
 
-        start_time = datetime.datetime.now()
+    def register_preloaded(
+        self,
+        fixed_image: ants.ANTsImage,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+        **kwargs,
+    ) -> None:
+        """
+        Register images using ANTs with an already decoded fixed image.
 
-        registration_kwargs = {**self.registration_params, **kwargs}
-        transformed_image_path = turbopath(transformed_image_path)
+        Args:
+            fixed_image (ants.ANTsImage): The fixed image, see `preload_image`.
+            fixed_image_path (str): Path the fixed image was read from (used for logging).
+            moving_image_path (str): Path to the moving image.
+            transformed_image_path (str): Path to the transformed image (output).
+            matrix_path (str): Path to the transformation matrix (output).
+            log_file_path (str): Path to the log file.
+            **kwargs: Additional registration parameters to update the instantiated defaults.
+        """
+        # we update the transformation parameters with the provided kwargs
 
-        matrix_path = turbopath(matrix_path)
-        if matrix_path.suffix != ".mat":
-            matrix_path = matrix_path.with_suffix(".mat")
+        start_time = datetime.datetime.now()
+        start_ns = time.perf_counter_ns()
 
-        fixed_image = ants.image_read(fixed_image_path)
-        moving_image = ants.image_read(moving_image_path)
-        registration_result = ants.registration(
-            fixed=fixed_image,
-            moving=moving_image,
-            **registration_kwargs,
+        # only merge when there is something to merge, the defaults are unpacked into ants anyway
+        registration_kwargs = (
+            {**self.registration_params, **kwargs}
+            if kwargs
+            else self.registration_params
         )
-        transformed_image = registration_result["warpedmovout"]
-        os.makedirs(transformed_image_path.parent, exist_ok=True)
-        ants.image_write(transformed_image, transformed_image_path)
+        # plain Path objects are enough here, each path is normalized once and reused for I/O and logging
+        transformed_image_path = Path(transformed_image_path)
+        matrix_path = Path(_with_mat_suffix(matrix_path))
+
+        check_input_files(moving_image_path)
+        moving_image = _fast_image_read(moving_image_path)
+        if self.downsample_spacing is not None:
+            # estimate the transform on coarser (linearly resampled) copies of both images
+            spacing = (self.downsample_spacing,) * fixed_image.dimension
+            registration_fixed = ants.resample_image(
+                fixed_image, spacing, use_voxels=False, interp_type=0
+            )
+            registration_moving = ants.resample_image(
+                moving_image, spacing, use_voxels=False, interp_type=0
+            )
+        else:
+            registration_fixed, registration_moving = fixed_image, moving_image
+
+        if (
+            registration_kwargs.get("type_of_transform") == "Rigid"
+            and max(registration_fixed.shape) <= SMALL_VOLUME_MAX_SHAPE
+        ):
+            # explicitly provided parameters take precedence over the fast path
+            registration_kwargs = {**SMALL_VOLUME_RIGID_PARAMS, **registration_kwargs}
         os.makedirs(matrix_path.parent, exist_ok=True)
-        shutil.copyfile(registration_result["fwdtransforms"][0], matrix_path)
-
+        # unless the user chose an outprefix, ANTs writes its transforms into a scratch directory
+        # next to the matrix path, so the matrix can be moved there by a rename instead of a copy
+        ants_output_dir = None
+        if "outprefix" not in registration_kwargs:
+            ants_output_dir = tempfile.mkdtemp(prefix=".ants_", dir=matrix_path.parent)
+            registration_kwargs = {
+                **registration_kwargs,
+                "outprefix": os.path.join(ants_output_dir, f"{matrix_path.stem}_"),
+            }
+        try:
+            registration_result = ants.registration(
+                fixed=registration_fixed,
+                moving=registration_moving,
+                **registration_kwargs,
+            )
+            if self.downsample_spacing is not None:
+                # the transform lives in physical space, so it applies to the full resolution images as well
+                transformed_image = ants.apply_transforms(
+                    fixed=fixed_image,
+                    moving=moving_image,
+                    transformlist=registration_result["fwdtransforms"],
+                )
+            else:
+                transformed_image = registration_result["warpedmovout"]
+            os.makedirs(transformed_image_path.parent, exist_ok=True)
+            self._write_image(
+                image=transformed_image, image_path=transformed_image_path
+            )
+            if ants_output_dir is not None:
+                os.replace(registration_result["fwdtransforms"][0], matrix_path)
+            else:
+                shutil.copyfile(registration_result["fwdtransforms"][0], matrix_path)
+        finally:
+            if ants_output_dir is not None:
+                shutil.rmtree(ants_output_dir, ignore_errors=True)
+
+        elapsed_ns = time.perf_counter_ns() - start_ns
         end_time = datetime.datetime.now()
 
         # TODO nicer logging
@@ -97,6 +361,7 @@ class ANTsRegistrator(Registrator):
             operation_name="registration",
             start_time=start_time,
             end_time=end_time,
+            elapsed_ns=elapsed_ns,
         )
 
     def transform(
@@ -119,26 +384,63 @@ class ANTsRegistrator(Registrator):
             log_file_path (str): Path to the log file.
             **kwargs: Additional transformation parameters to update the instantiated defaults.
         """
+        self.transform_preloaded(
+            fixed_image=self.preload_image(fixed_image_path),
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+            **kwargs,
+        )
+
+    def transform_preloaded(
+        self,
+        fixed_image: ants.ANTsImage,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+        **kwargs,
+    ) -> None:
+        """
+        Apply a transformation using ANTs with an already decoded fixed image.
+
+        Args:
+            fixed_image (ants.ANTsImage): The fixed image, see `preload_image`.
+            fixed_image_path (str): Path the fixed image was read from (used for logging).
+            moving_image_path (str): Path to the moving image.
+            transformed_image_path (str): Path to the transformed image (output).
+            matrix_path (str): Path to the transformation matrix.
+            log_file_path (str): Path to the log file.
+            **kwargs: Additional transformation parameters to update the instantiated defaults.
+        """
         start_time = datetime.datetime.now()
+        start_ns = time.perf_counter_ns()
 
         # we update the transformation parameters with the provided kwargs
-        transform_kwargs = {**self.transformation_params, **kwargs}
-        fixed_image = ants.image_read(fixed_image_path)
-        moving_image = ants.image_read(moving_image_path)
-        transformed_image_path = turbopath(transformed_image_path)
+        transform_kwargs = (
+            {**self.transformation_params, **kwargs}
+            if kwargs
+            else self.transformation_params
+        )
+        matrix_path = _with_mat_suffix(matrix_path)
+        check_input_files(moving_image_path, matrix_path)
+
+        moving_image = _fast_image_read(moving_image_path)
+        transformed_image_path = Path(transformed_image_path)
         os.makedirs(transformed_image_path.parent, exist_ok=True)
 
-        matrix_path = turbopath(matrix_path)
-        if matrix_path.suffix != ".mat":
-            matrix_path = matrix_path.with_suffix(".mat")
         transformed_image = ants.apply_transforms(
             fixed=fixed_image,
             moving=moving_image,
             transformlist=[matrix_path],
             **transform_kwargs,
         )
-        ants.image_write(transformed_image, transformed_image_path)
+        self._write_image(image=transformed_image, image_path=transformed_image_path)
 
+        elapsed_ns = time.perf_counter_ns() - start_ns
         end_time = datetime.datetime.now()
 
         # TODO nicer logging
@@ -153,8 +455,52 @@ class ANTsRegistrator(Registrator):
             operation_name="transformation",
             start_time=start_time,
             end_time=end_time,
+            elapsed_ns=elapsed_ns,
         )
 
+    def _write_image(self, image: ants.ANTsImage, image_path: str) -> None:
+        """
+        Write an image, compressing ".nii.gz" files with the configured level (and pigz if enabled).
+
+        Args:
+            image (ants.ANTsImage): The image to write.
+            image_path (str): Path to the output image.
+        """
+        image_path = str(image_path)
+        if not image_path.endswith(".nii.gz"):
+            ants.image_write(image, image_path)
+            return
+
+        fd, uncompressed_path = tempfile.mkstemp(
+            suffix=".nii", dir=os.path.dirname(image_path) or None
+        )
+        os.close(fd)
+        try:
+            ants.image_write(image, uncompressed_path)
+            pigz = shutil.which("pigz") if self.use_pigz else None
+            if pigz:
+                with open(image_path, "wb") as f:
+                    subprocess.run(
+                        [
+                            pigz,
+                            "-c",
+                            f"-{self.compression_level}",
+                            "-p",
+                            str(os.cpu_count() or 1),
+                            uncompressed_path,
+                        ],
+                        stdout=f,
+                        check=True,
+                    )
+            else:
+                gzip_copy(
+                    src=uncompressed_path,
+                    dst=image_path,
+                    compresslevel=self.compression_level,
+                )
+        finally:
+            os.remove(uncompressed_path)
+
     @staticmethod
     def _log_to_file(
         log_file_path: str,
@@ -165,28 +511,48 @@ class ANTsRegistrator(Registrator):
         operation_name: str,
         start_time,
         end_time,
+        elapsed_ns: int,
     ):
 
-        # Calculate the duration and make it human readable
-        duration = (end_time - start_time).total_seconds()
-
-        hours = int(duration // 3600)
-        minutes = int((duration % 3600) // 60)
-        seconds = int(duration % 60)
-        milliseconds = int((duration - int(duration)) * 1000)
+        # Make the measured duration human readable (integer arithmetic only)
+        hours, remainder = divmod(elapsed_ns // 1_000_000, 3_600_000)
+        minutes, remainder = divmod(remainder, 60_000)
+        seconds, milliseconds = divmod(remainder, 1000)
 
         # Format the duration as "0:0:0:0"
         duration_formatted = f"{hours}h {minutes}m {seconds}s {milliseconds}ms"
 
-        with open(log_file_path, "w") as f:
-            f.write(f"*** {operation_name} with antspyx ***\n")
-            f.write(f"start time: {start_time} \n")
-            f.write(f"fixed image: {fixed_image_path} \n")
-            f.write(f"moving image: {moving_image_path} \n")
-            f.write(f"transformed image: {transformed_image_path} \n")
-            f.write(f"matrix: {matrix_path} \n")
-            f.write(f"end time: {end_time} \n")
-            f.write(f"duration: {duration_formatted}\n")
+        Path(log_file_path).write_text(
+            f"*** {operation_name} with antspyx ***\n"
+            f"start time: {start_time} \n"
+            f"fixed image: {fixed_image_path} \n"
+            f"moving image: {moving_image_path} \n"
+            f"transformed image: {transformed_image_path} \n"
+            f"matrix: {matrix_path} \n"
+            f"end time: {end_time} \n"
+            f"duration: {duration_formatted}\n"
+        )
+
+
+def _with_mat_suffix(matrix_path: str) -> str:
+    """
+    Replace (or add) the suffix of a matrix path with ".mat" using plain string operations.
+
+    Args:
+        matrix_path (str): Path to the transformation matrix.
+
+    Returns:
+        str: The matrix path ending in ".mat".
+    """
+    matrix_path = str(matrix_path)
+    if matrix_path.endswith(".mat"):
+        return matrix_path
+    # like pathlib, a leading dot (hidden file) does not start a suffix
+    name = os.path.basename(matrix_path)
+    dot = name.rfind(".")
+    if dot > 0:
+        return matrix_path[: len(matrix_path) - len(name) + dot] + ".mat"
+    return matrix_path + ".mat"
 
 
 if __name__ == "__main__":
@@ -1,195 +1,361 @@
+import functools
 import os
 import shlex
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import chain
 
-from app.project_e.image_processing.utilities.utils import eleSubprocess
 from flask_socketio import SocketIO
 
+from brainles_preprocessing.utils import outputs_up_to_date
 
-def ants_registrator(
-    fixed_image, moving_image, outputmat, transformationalgorithm="rigid"
+
+@dataclass(frozen=True)
+class Stage:
+    # one stage of the antsRegistration pipeline, using the Mattes metric
+    transform: str
+    sampling: str
+    convergence: str
+    smoothing: str
+    shrink: str
+
+    def to_args(self, fixed_image, moving_image, num_histogram_bins):
+        # a 16x16 joint histogram stays in L1 cache during the parallel accumulation and suffices for brain MR
+        metric = "Mattes[%s,%s,1,%s,%s]" % (
+            fixed_image,
+            moving_image,
+            num_histogram_bins,
+            self.sampling,
+        )
+        return [
+            *["-t", self.transform],
+            *["-m", metric],
+            *["-c", self.convergence],
+            *["-s", self.smoothing],
+            *["-f", self.shrink],
+        ]
+
+    def with_halved_shrink(self):
+        # for images that were already downsampled by a factor of about 2
+        shrink = "x".join(
+            str(max(1, (int(factor) + 1) // 2)) for factor in self.shrink.split("x")
+        )
+        return replace(self, shrink=shrink)
+
+
+# speed-tuned schedule for rigid and affine stages of 1mm brain volumes
+FAST_SCHEDULE = {
+    "convergence": "[50x25x10x0,1e-5,5]",
+    "smoothing": "4x3x0x0",
+    "shrink": "4x3x2x1",
+}
+
+REX_DFC_STAGES = [
+    Stage("translation[0.1]", "Regular,0.05", "[1000,1e-8,20]", "4vox", "6"),
+    Stage("rigid[0.1]", "Regular,0.1", "[1000x1000,1e-8,20]", "4x2vox", "4x2"),
+    Stage("affine[0.1]", "Regular,0.1", "[10000x1111x5,1e-8,20]", "3x2x1vox", "8x4x2"),
+]
+
+
+@functools.cache
+def ants_call_template(
+    transformationalgorithm,
+    sampling,
+    num_histogram_bins,
+    final_interpolation,
+    presampled=False,
 ):
-    # ants call parameters
-    dimensionality = "-d 3"
-    initial_moving_transform = "-r [" + fixed_image + ", " + moving_image + ", 0]"
+    # antsRegistration argv with "{f}", "{m}" and "{o}" placeholders for the fixed image, moving image and output
 
     # transformations
     if transformationalgorithm == "rigid":
-        # rigid ants_transformation
-        transform_rigid = "-t rigid[0.1]"
-        metric_rigid = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.5]"
-        )
-        convergence_rigid = "-c [1000x500x250, 1e-6, 10]"
-        smoothing_sigmas_rigid = "-s 3x2x1vox"
-        shrink_factors_rigid = "-f 8x4x2"
+        stages = [Stage("rigid[0.1]", sampling, **FAST_SCHEDULE)]
     elif transformationalgorithm == "rigid+affine":
-        # rigid ants_transformation
-        transform_rigid = "-t rigid[0.1]"
-        metric_rigid = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.5]"
-        )
-        convergence_rigid = "-c [1000x500x250, 1e-6, 10]"
-        smoothing_sigmas_rigid = "-s 3x2x1vox"
-        shrink_factors_rigid = "-f 8x4x2"
-
-        # affine ants_transformation
-        transform_affine = "-t affine[0.1]"
-        metric_affine = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.5]"
-        )
-        convergence_affine = "-c [1000x500x250, 1e-6, 10]"
-        smoothing_sigmas_affine = "-s 3x2x1vox"
-        shrink_factors_affine = "-f 8x4x2"
+        stages = [
+            Stage("rigid[0.1]", sampling, **FAST_SCHEDULE),
+            Stage("affine[0.1]", sampling, **FAST_SCHEDULE),
+        ]
     elif transformationalgorithm == "rex-dfc":
-        # translation
-        transform_translation = "-t translation[0.1]"
-        metric_translation = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.05]"
-        )
-        convergence_translation = "-c [1000, 1e-8, 20]"
-        smoothing_sigmas_translation = "-s 4vox"
-        shrink_factors_translation = "-f 6"
-
-        # rigid ants_transformation
-        transform_rigid = "-t rigid[0.1]"
-        metric_rigid = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.1]"
-        )
-        convergence_rigid = "-c [1000x1000, 1e-8, 20]"
-        smoothing_sigmas_rigid = "-s 4x2vox"
-        shrink_factors_rigid = "-f 4x2"
-
-        # affine ants_transformation
-        transform_affine = "-t affine[0.1]"
-        metric_affine = (
-            "-m Mattes[" + fixed_image + "," + moving_image + ", 1, 32, Regular, 0.1]"
-        )
-        convergence_affine = "-c [10000x1111x5, 1e-8, 20]"
-        smoothing_sigmas_affine = "-s 3x2x1vox"
-        shrink_factors_affine = "-f 8x4x2"
-
-    # other parameters
-    use_estimate_learning_rate_once = "-l 1"
-    collapse_output_transforms = "-z 1"
-    interpolation = "-n BSpline[3]"
-    precision = "--float 1"
-    output = "-o " + "[" + outputmat + "]"
-
-    # generate calls
-    if transformationalgorithm == "rigid":
-        ants_cmd = (
-            "antsRegistration",
-            dimensionality,
-            initial_moving_transform,
-            # rigid ants_transformation
-            transform_rigid,
-            metric_rigid,
-            convergence_rigid,
-            smoothing_sigmas_rigid,
-            shrink_factors_rigid,
-            # other parameters
-            use_estimate_learning_rate_once,
-            collapse_output_transforms,
-            interpolation,
-            precision,
-            output,
-        )
-        ants_call = shlex.split("%s %s %s %s %s %s %s %s %s %s %s %s %s" % ants_cmd)
+        stages = REX_DFC_STAGES
+    else:
+        raise ValueError(f"Unknown transformation algorithm: {transformationalgorithm}")
+    if presampled:
+        # the pyramid starts from the already coarse images
+        stages = [stage.with_halved_shrink() for stage in stages]
 
-    elif transformationalgorithm == "rigid+affine":
-        ants_cmd = (
-            "antsRegistration",
-            dimensionality,
-            initial_moving_transform,
-            # rigid ants_transformation
-            transform_rigid,
-            metric_rigid,
-            convergence_rigid,
-            smoothing_sigmas_rigid,
-            shrink_factors_rigid,
-            # affine ants_transformation
-            transform_affine,
-            metric_affine,
-            convergence_affine,
-            smoothing_sigmas_affine,
-            shrink_factors_affine,
-            # other parameters
-            use_estimate_learning_rate_once,
-            collapse_output_transforms,
-            interpolation,
-            precision,
-            output,
-        )
-        ants_call = shlex.split(
-            "%s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s" % ants_cmd
-        )
+    # the call is passed to subprocess as argv without shell parsing, so paths containing spaces stay intact
+    return (
+        "antsRegistration",
+        # ants call parameters
+        *["-d", "3"],
+        *["-r", "[{f},{m},0]"],
+        *chain.from_iterable(
+            stage.to_args("{f}", "{m}", num_histogram_bins) for stage in stages
+        ),
+        # other parameters
+        *["-l", "1"],
+        *["-z", "1"],
+        # linear needs a fraction of the operations per voxel of BSpline[3], pass "BSpline[3]" for the final output
+        *["-n", final_interpolation],
+        *["--float", "1"],
+        *["-o", "[{o}]"],
+    )
 
-    elif transformationalgorithm == "rex-dfc":
-        ants_cmd = (
-            "antsRegistration",
-            dimensionality,
-            initial_moving_transform,
-            # translation
-            transform_translation,
-            metric_translation,
-            convergence_translation,
-            smoothing_sigmas_translation,
-            shrink_factors_translation,
-            # rigid ants_transformation
-            transform_rigid,
-            metric_rigid,
-            convergence_rigid,
-            smoothing_sigmas_rigid,
-            shrink_factors_rigid,
-            # affine ants_transformation
-            transform_affine,
-            metric_affine,
-            convergence_affine,
-            smoothing_sigmas_affine,
-            shrink_factors_affine,
-            # other parameters
-            use_estimate_learning_rate_once,
-            collapse_output_transforms,
-            interpolation,
-            precision,
-            output,
-        )
-        ants_call = shlex.split(
-            "%s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s"
-            % ants_cmd
+
+def presample_image(image, spacing_mm, output_path):
+    # gaussian smoothing followed by resampling to an isotropic spacing, using the ants tool chain
+    subprocess.run(
+        [
+            "ResampleImageBySpacing",
+            "3",
+            image,
+            output_path,
+            *[str(spacing_mm)] * 3,
+            "1",
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return output_path
+
+
+def _load_fireants_registrator(transformationalgorithm="rigid"):
+    # the FireANTs backend of the package, None if fireants or a CUDA device is unavailable
+    try:
+        import torch
+
+        from brainles_preprocessing.registration.FireANTs.FireANTs import (
+            FireANTsRegistrator,
         )
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+    # rigid+affine: FireANTsRegistrator initializes its affine stage with the rigid result
+    transform_type = "Affine" if transformationalgorithm == "rigid+affine" else "Rigid"
+    return FireANTsRegistrator(transform_type=transform_type)
+
+
+def load_fireants_image(image):
+    # loads an image onto the GPU, None if fireants or a CUDA device is unavailable or the image cannot be loaded
+    registrator = _load_fireants_registrator()
+    if registrator is None:
+        return None
+    try:
+        return registrator.preload_image(image)
+    except RuntimeError:
+        # e.g. a file SimpleITK cannot read, or too little GPU memory
+        return None
+
+
+def fireants_registrator(
+    fixed_image,
+    moving_image,
+    outputmat,
+    transformationalgorithm="rigid",
+    fixed=None,
+):
+    # GPU registration with FireANTsRegistrator and its multi-resolution schedule, which ends at full resolution.
+    # returns False if fireants or a CUDA device is unavailable or an image cannot be loaded,
+    # so the caller can fall back to antsRegistration
+    if transformationalgorithm not in ("rigid", "rigid+affine"):
+        return False
+    registrator = _load_fireants_registrator(transformationalgorithm)
+    if registrator is None:
+        return False
+    # an already loaded fixed image can be passed to keep it on the GPU across registrations
+    if fixed is None:
+        fixed = load_fireants_image(fixed_image)
+    moving = load_fireants_image(moving_image)
+    if fixed is None or moving is None:
+        return False
+
+    # same file name antsRegistration uses for the collapsed linear transform of an -o prefix
+    registrator.estimate_transforms(
+        fixed_image=fixed,
+        moving_images=[moving],
+        matrix_paths=[outputmat + "0GenericAffine.mat"],
+    )
+    return True
+
+
+def ants_registrator(
+    fixed_image,
+    moving_image,
+    outputmat,
+    transformationalgorithm="rigid",
+    sampling_strategy="Random",
+    sampling_percentage=0.25,
+    backend="ants",
+    reuse_outputs=False,
+    final_interpolation="Linear",
+    num_histogram_bins=16,
+    fireants_fixed=None,
+    presample_to_mm=None,
+):
+    # opt-in: a transform newer than both images is reused even if the registration parameters changed
+    if reuse_outputs and outputs_up_to_date(
+        [outputmat + "0GenericAffine.mat"], [fixed_image, moving_image]
+    ):
+        return
+
+    if backend == "fireants" and fireants_registrator(
+        fixed_image,
+        moving_image,
+        outputmat,
+        transformationalgorithm,
+        fixed=fireants_fixed,
+    ):
+        return
+
+    # random sampling of a quarter of the voxels converges like dense regular sampling for rigid/affine
+    # brain registration, at a fraction of the metric evaluations
+    template = ants_call_template(
+        transformationalgorithm,
+        "%s,%s" % (sampling_strategy, sampling_percentage),
+        num_histogram_bins,
+        final_interpolation,
+        presampled=presample_to_mm is not None,
+    )
+
+    # rigid/affine registration at 2mm is as accurate as at native resolution, with 8x fewer voxels per iteration.
+    # the transform lives in physical space, so it still applies to the native resolution images
+    presample_dir = None
+    if presample_to_mm is not None:
+        presample_dir = tempfile.mkdtemp(prefix="ants_presample_")
+        try:
+            fixed_image = presample_image(
+                fixed_image,
+                presample_to_mm,
+                os.path.join(presample_dir, "fixed_" + os.path.basename(fixed_image)),
+            )
+            moving_image = presample_image(
+                moving_image,
+                presample_to_mm,
+                os.path.join(presample_dir, "moving_" + os.path.basename(moving_image)),
+            )
+        except BaseException:
+            shutil.rmtree(presample_dir, ignore_errors=True)
+            raise
+
+    # only the paths change between calls, everything else comes from the cached template
+    ants_call = [
+        arg.format(f=fixed_image, m=moving_image, o=outputmat) for arg in template
+    ]
 
     # construct call
-    readable_ants_call = " ".join(ants_cmd)
+    readable_ants_call = shlex.join(ants_call)
     print("calling ants with the following call:")
     print(readable_ants_call)
 
     # log file
     logFilePath = outputmat + "registration.log"
-    # call it
-    eleSubprocess(logFilePath=logFilePath, call=ants_call)
+    # call it, ants writes its output straight into the log file without passing through python
+    try:
+        with open(logFilePath, "wb") as log_file:
+            subprocess.run(
+                ants_call, stdout=log_file, stderr=subprocess.STDOUT, check=True
+            )
+    finally:
+        if presample_dir is not None:
+            shutil.rmtree(presample_dir, ignore_errors=True)
 
 
-def modality_registrator(examid, modality):
-    socketio = SocketIO(message_queue="redis://")
-    socketio.emit(
-        "ipstatus", {"examid": examid, "ipstatus": modality + " ants registration"}
-    )
+def _set_itk_threads(threads_per_job):
+    # inherited by the antsRegistration subprocesses started in this worker
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(threads_per_job)
 
-    niftipath = os.path.normpath(os.path.join("data/tmp/", examid, "raw_niftis"))
-    # fixed image
-    native_t1 = os.path.join(niftipath, examid + "_native_t1.nii.gz")
 
-    # moving images
-    moving_image = os.path.join(niftipath, examid + "_native_" + modality + ".nii.gz")
+class ModalityBatchRegistrator:
+    # registers the modalities of one exam to its native t1, the exam paths are set up only once
 
-    # output mats
-    exportpath = os.path.normpath(os.path.join("data/tmp/", examid, "registrations"))
-    os.makedirs(exportpath, exist_ok=True)
-    filename = examid + "_" + modality + "_to_t1_"
-    outputmat = os.path.join(exportpath, filename)
+    def __init__(self, examid, backend="ants", threads_per_job=4):
+        self.examid = examid
+        self.backend = backend
+        self.threads_per_job = threads_per_job
 
-    # call it
-    ants_registrator(
-        native_t1, moving_image, outputmat, transformationalgorithm="rigid"
-    )
+        niftipath = os.path.normpath(os.path.join("data/tmp/", examid, "raw_niftis"))
+        self.niftipath = niftipath
+        # fixed image
+        self.native_t1 = os.path.join(niftipath, examid + "_native_t1.nii.gz")
+        if not os.path.isfile(self.native_t1):
+            raise FileNotFoundError(f"Fixed image not found: {self.native_t1}")
+
+        # output mats
+        self.exportpath = os.path.normpath(
+            os.path.join("data/tmp/", examid, "registrations")
+        )
+        os.makedirs(self.exportpath, exist_ok=True)
+
+        self.socketio = SocketIO(message_queue="redis://")
+        self._fireants_fixed = None
+
+    def _emit_status(self, modality):
+        self.socketio.emit(
+            "ipstatus",
+            {"examid": self.examid, "ipstatus": modality + " ants registration"},
+        )
+
+    def _registration_args(self, modality):
+        # moving image and output prefix of a modality
+        moving_image = os.path.join(
+            self.niftipath, self.examid + "_native_" + modality + ".nii.gz"
+        )
+        filename = self.examid + "_" + modality + "_to_t1_"
+        return self.native_t1, moving_image, os.path.join(self.exportpath, filename)
+
+    def register_modality(self, modality):
+        self._emit_status(modality)
+        if self.backend == "fireants" and self._fireants_fixed is None:
+            # the t1 is copied to the GPU once and stays there for all modalities
+            self._fireants_fixed = load_fireants_image(self.native_t1)
+        ants_registrator(
+            *self._registration_args(modality),
+            transformationalgorithm="rigid",
+            backend=self.backend,
+            fireants_fixed=self._fireants_fixed,
+        )
+
+    def register_modalities(self, modalities):
+        if self.backend == "fireants":
+            # the GPU resident t1 cannot be shared with worker processes
+            for modality in modalities:
+                self.register_modality(modality)
+            return
+
+        for modality in modalities:
+            self._emit_status(modality)
+
+        # the modalities are independent, ants scales poorly beyond a few threads per job,
+        # so several jobs with few threads each finish sooner than one job after the other
+        max_workers = max(
+            1, min(len(modalities), (os.cpu_count() or 1) // self.threads_per_job)
+        )
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_set_itk_threads,
+            initargs=(self.threads_per_job,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    ants_registrator,
+                    *self._registration_args(modality),
+                    transformationalgorithm="rigid",
+                )
+                for modality in modalities
+            ]
+            for future in futures:
+                future.result()
+
+
+def modality_registrator(examid, modalities, threads_per_job=4, backend="ants"):
+    # a single modality name is still accepted
+    if isinstance(modalities, str):
+        modalities = [modalities]
+
+    ModalityBatchRegistrator(
+        examid, backend=backend, threads_per_job=threads_per_job
+    ).register_modalities(modalities)
@@ -0,0 +1,420 @@
+import datetime
+import functools
+import inspect
+import os
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+try:
+    import SimpleITK as sitk
+    from fireants.io.image import BatchedImages, Image
+    from fireants.registration.affine import AffineRegistration
+    from fireants.registration.rigid import RigidRegistration
+except ImportError as error:
+    raise ImportError(
+        "FireANTsRegistrator requires fireants and SimpleITK, install them using "
+        "'pip install brainles_preprocessing[fireants]'"
+    ) from error
+
+from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import check_and_add_suffix
+
+# older fireants releases can neither skip writing the moved images nor export ITK transforms
+if "save_transformed" not in inspect.signature(
+    RigidRegistration.optimize
+).parameters or not hasattr(RigidRegistration, "save_as_ants_transforms"):
+    raise ImportError(
+        "FireANTsRegistrator requires a fireants release providing optimize(save_transformed=...) and "
+        "save_as_ants_transforms, upgrade it using 'pip install -U fireants'"
+    )
+
+
+class FireANTsRegistrator(Registrator):
+    def __init__(
+        self,
+        transform_type: str = "Rigid",
+        scales: Sequence[int] = (4, 2, 1),
+        iterations: Sequence[int] = (200, 100, 50),
+        loss_type: str = "mi",
+        optimizer: str = "Adam",
+        optimizer_lr: float = 3e-3,
+        device: str = "cuda",
+        compression_level: int = 6,
+    ):
+        """
+        Initialize the FireANTsRegistrator, a GPU implementation of the ANTs rigid and affine registrations.
+
+        Args:
+            transform_type (str, optional): "Rigid" or "Affine". Defaults to "Rigid".
+            scales (Sequence[int], optional): Downsampling factors of the multi-resolution levels. Defaults to (4, 2, 1).
+            iterations (Sequence[int], optional): Iterations per level. Defaults to (200, 100, 50).
+            loss_type (str, optional): Similarity metric, "mi" mirrors the Mattes metric used with ANTs. Defaults to "mi".
+            optimizer (str, optional): Optimizer used by FireANTs. Defaults to "Adam".
+            optimizer_lr (float, optional): Learning rate of the optimizer. Defaults to 3e-3.
+            device (str, optional): Torch device the images are loaded to. Defaults to "cuda".
+            compression_level (int, optional): gzip level (1-9) for ".nii.gz" outputs. Defaults to 6.
+        """
+        if transform_type not in ("Rigid", "Affine"):
+            raise ValueError(f"Unsupported transform type: {transform_type}")
+        self.transform_type = transform_type
+        self.registration_params = {
+            "scales": list(scales),
+            "iterations": list(iterations),
+            "loss_type": loss_type,
+            "optimizer": optimizer,
+            "optimizer_lr": optimizer_lr,
+        }
+        self.device = device
+        self.compression_level = compression_level
+
+    def preload_image(self, image_path: str) -> Image:
+        """
+        Load an image onto the device, so a fixed image stays resident across several registrations.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            Image: The FireANTs image, to be passed to `register_preloaded`.
+        """
+        return Image.load_file(str(image_path), device=self.device)
+
+    def matrix_file_path(self, matrix_path: str) -> str:
+        return check_and_add_suffix(matrix_path, ".mat")
+
+    def registration_settings(self) -> Tuple:
+        return (self.transform_type, tuple(sorted(self.registration_params.items())))
+
+    def register(
+        self,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+    ) -> None:
+        """
+        Register images using FireANTs.
+
+        Args:
+            fixed_image_path (str): Path to the fixed image.
+            moving_image_path (str): Path to the moving image.
+            transformed_image_path (str): Path to the transformed image (output).
+            matrix_path (str): Path to the transformation matrix (output).
+            log_file_path (str): Path to the log file.
+        """
+        self.register_preloaded(
+            fixed_image=self.preload_image(fixed_image_path),
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def register_preloaded(
+        self,
+        fixed_image: Image,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+    ) -> None:
+        """
+        Register images using FireANTs with a fixed image already loaded to the device.
+
+        Args:
+            fixed_image (Image): The fixed image, see `preload_image`.
+            fixed_image_path (str): Path the fixed image was read from.
+            moving_image_path (str): Path to the moving image.
+            transformed_image_path (str): Path to the transformed image (output).
+            matrix_path (str): Path to the transformation matrix (output).
+            log_file_path (str): Path to the log file.
+        """
+        self._register_loaded(
+            fixed_image=fixed_image,
+            fixed_image_path=fixed_image_path,
+            moving_images=[self.preload_image(moving_image_path)],
+            moving_image_paths=[moving_image_path],
+            transformed_image_paths=[transformed_image_path],
+            matrix_paths=[matrix_path],
+            log_file_paths=[log_file_path],
+        )
+
+    def register_batch(
+        self,
+        fixed_image_path: str,
+        moving_image_paths: List[str],
+        transformed_image_paths: List[str],
+        matrix_paths: List[str],
+        log_file_paths: List[str],
+        n_jobs: int = 1,
+    ) -> None:
+        """
+        Register several moving images to the same fixed image in one batched FireANTs optimization.
+
+        The fixed image is copied to the device once. Moving images of differing shapes cannot be
+        stacked into one batch, they are registered one after the other.
+
+        Args:
+            fixed_image_path (str): Path to the fixed image shared by all registrations.
+            moving_image_paths (List[str]): Paths to the moving images.
+            transformed_image_paths (List[str]): Paths to the transformed images (output).
+            matrix_paths (List[str]): Paths to the transformation matrices (output).
+            log_file_paths (List[str]): Paths to the log files.
+            n_jobs (int, optional): Ignored, the batch already runs in parallel on the device.
+        """
+        fixed_image = self.preload_image(fixed_image_path)
+        moving_images = [self.preload_image(path) for path in moving_image_paths]
+        if len({tuple(image.array.shape) for image in moving_images}) <= 1:
+            self._register_loaded(
+                fixed_image=fixed_image,
+                fixed_image_path=fixed_image_path,
+                moving_images=moving_images,
+                moving_image_paths=moving_image_paths,
+                transformed_image_paths=transformed_image_paths,
+                matrix_paths=matrix_paths,
+                log_file_paths=log_file_paths,
+            )
+            return
+
+        for (
+            moving_image,
+            moving_image_path,
+            transformed_image_path,
+            matrix_path,
+            log_file_path,
+        ) in zip(
+            moving_images,
+            moving_image_paths,
+            transformed_image_paths,
+            matrix_paths,
+            log_file_paths,
+            strict=True,
+        ):
+            self._register_loaded(
+                fixed_image=fixed_image,
+                fixed_image_path=fixed_image_path,
+                moving_images=[moving_image],
+                moving_image_paths=[moving_image_path],
+                transformed_image_paths=[transformed_image_path],
+                matrix_paths=[matrix_path],
+                log_file_paths=[log_file_path],
+            )
+
+    def estimate_transforms(
+        self,
+        fixed_image: Image,
+        moving_images: List[Image],
+        matrix_paths: List[str],
+    ) -> List[str]:
+        """
+        Optimize the transforms of a batch of moving images and save them, without resampling the moving images.
+
+        Args:
+            fixed_image (Image): The fixed image, see `preload_image`.
+            moving_images (List[Image]): The moving images of the batch, all of the same shape.
+            matrix_paths (List[str]): Paths to the transformation matrices (output), one per moving image.
+
+        Returns:
+            List[str]: The paths of the written matrix files, see `matrix_file_path`.
+        """
+        # the same fixed image is broadcast to every moving image of the batch
+        fixed_batch = BatchedImages([fixed_image] * len(moving_images))
+        moving_batch = BatchedImages(moving_images)
+
+        registration = RigidRegistration(
+            fixed_images=fixed_batch,
+            moving_images=moving_batch,
+            **self.registration_params,
+        )
+        registration.optimize(save_transformed=False)
+        if self.transform_type == "Affine":
+            registration = AffineRegistration(
+                fixed_images=fixed_batch,
+                moving_images=moving_batch,
+                init_rigid=registration.get_rigid_matrix(),
+                **self.registration_params,
+            )
+            registration.optimize(save_transformed=False)
+
+        matrix_paths = [self.matrix_file_path(path) for path in matrix_paths]
+        for matrix_path in matrix_paths:
+            os.makedirs(Path(matrix_path).parent, exist_ok=True)
+        # ITK transform files, readable by ANTs and SimpleITK
+        registration.save_as_ants_transforms(matrix_paths)
+        return matrix_paths
+
+    def _register_loaded(
+        self,
+        fixed_image: Image,
+        fixed_image_path: str,
+        moving_images: List[Image],
+        moving_image_paths: List[str],
+        transformed_image_paths: List[str],
+        matrix_paths: List[str],
+        log_file_paths: List[str],
+    ) -> None:
+        start_time = datetime.datetime.now()
+        matrix_paths = self.estimate_transforms(
+            fixed_image=fixed_image,
+            moving_images=moving_images,
+            matrix_paths=matrix_paths,
+        )
+
+        fixed_grid = _read_grid(fixed_image_path)
+        for (
+            moving_image_path,
+            transformed_image_path,
+            matrix_path,
+            log_file_path,
+        ) in zip(
+            moving_image_paths,
+            transformed_image_paths,
+            matrix_paths,
+            log_file_paths,
+            strict=True,
+        ):
+            _resample(
+                fixed_grid=fixed_grid,
+                moving_image_path=moving_image_path,
+                transformed_image_path=transformed_image_path,
+                matrix_path=matrix_path,
+                compression_level=self.compression_level,
+            )
+            _log_to_file(
+                log_file_path=log_file_path,
+                fixed_image_path=fixed_image_path,
+                moving_image_path=moving_image_path,
+                transformed_image_path=transformed_image_path,
+                matrix_path=matrix_path,
+                operation_name="registration",
+                start_time=start_time,
+                end_time=datetime.datetime.now(),
+            )
+
+    def transform(
+        self,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+    ) -> None:
+        """
+        Apply a transformation computed by `register`, resampling the moving image onto the fixed image grid.
+
+        Args:
+            fixed_image_path (str): Path to the fixed image.
+            moving_image_path (str): Path to the moving image.
+            transformed_image_path (str): Path to the transformed image (output).
+            matrix_path (str): Path to the transformation matrix.
+            log_file_path (str): Path to the log file.
+        """
+        start_time = datetime.datetime.now()
+        matrix_path = check_and_add_suffix(matrix_path, ".mat")
+        _resample(
+            fixed_grid=_read_grid(fixed_image_path),
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            compression_level=self.compression_level,
+        )
+        _log_to_file(
+            log_file_path=log_file_path,
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            operation_name="transformation",
+            start_time=start_time,
+            end_time=datetime.datetime.now(),
+        )
+
+
+def _read_grid(image_path: str) -> Tuple:
+    """
+    Read the voxel grid (size, origin, spacing, direction) of an image from its header only.
+
+    Args:
+        image_path (str): Path to the image.
+
+    Returns:
+        Tuple: Size, origin, spacing and direction of the image.
+    """
+    stat = os.stat(image_path)
+    return _cached_grid(str(image_path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_grid(image_path: str, mtime_ns: int, size: int) -> Tuple:
+    # mtime and size are only part of the cache key, so files changed on disk are read again
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(image_path)
+    reader.ReadImageInformation()
+    return (
+        reader.GetSize(),
+        reader.GetOrigin(),
+        reader.GetSpacing(),
+        reader.GetDirection(),
+    )
+
+
+def _resample(
+    fixed_grid: Tuple,
+    moving_image_path: str,
+    transformed_image_path: str,
+    matrix_path: str,
+    compression_level: int = 6,
+) -> None:
+    """
+    Resample the moving image onto the fixed image grid with a saved transform.
+
+    Args:
+        fixed_grid (Tuple): Size, origin, spacing and direction of the fixed image, see `_read_grid`.
+        moving_image_path (str): Path to the moving image.
+        transformed_image_path (str): Path to the transformed image (output).
+        matrix_path (str): Path to the ITK transform file.
+        compression_level (int, optional): gzip level (1-9) used if the output is a ".nii.gz". Defaults to 6.
+    """
+    size, origin, spacing, direction = fixed_grid
+    transformed_image = sitk.Resample(
+        sitk.ReadImage(str(moving_image_path), sitk.sitkFloat32),
+        size,
+        sitk.ReadTransform(str(matrix_path)),
+        sitk.sitkLinear,
+        origin,
+        spacing,
+        direction,
+        0.0,
+    )
+    os.makedirs(Path(transformed_image_path).parent, exist_ok=True)
+    sitk.WriteImage(
+        transformed_image,
+        str(transformed_image_path),
+        useCompression=str(transformed_image_path).endswith(".gz"),
+        compressionLevel=compression_level,
+    )
+
+
+def _log_to_file(
+    log_file_path: str,
+    fixed_image_path: str,
+    moving_image_path: str,
+    transformed_image_path: str,
+    matrix_path: str,
+    operation_name: str,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+) -> None:
+    Path(log_file_path).write_text(
+        f"*** {operation_name} with fireants ***\n"
+        f"start time: {start_time} \n"
+        f"fixed image: {fixed_image_path} \n"
+        f"moving image: {moving_image_path} \n"
+        f"transformed image: {transformed_image_path} \n"
+        f"matrix: {matrix_path} \n"
+        f"end time: {end_time} \n"
+        f"duration: {end_time - start_time}\n"
+    )
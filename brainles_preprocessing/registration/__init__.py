@@ -1,18 +1,55 @@
+import importlib
 import warnings
 
-try:
-    from .ANTs.ANTs import ANTsRegistrator
-except ImportError:
-    warnings.warn(
-        "ANTS package not found. If you want to use it, please install it using 'pip install brainles_preprocessing[ants]'"
-    )
+from ._threadconfig import set_itk_threads
+from .cached_registrator import CachedRegistrator
+from .niftyreg.niftyreg import NiftyRegRegistrator
 
-try:
-    from .eReg.eReg import eRegRegistrator
-except ImportError:
-    warnings.warn(
-        "eReg package not found. If you want to use it, please install it using 'pip install brainles_preprocessing[ereg]'"
-    )
+# the backends depending on optional packages are only imported when they are first accessed,
+# so users of one backend do not pay the import time of the others
+_OPTIONAL_REGISTRATORS = {
+    "ANTsRegistrator": (
+        ".ANTs.ANTs",
+        "ANTS package not found. If you want to use it, please install it using 'pip install brainles_preprocessing[ants]'",
+    ),
+    "eRegRegistrator": (
+        ".eReg.eReg",
+        "eReg package not found. If you want to use it, please install it using 'pip install brainles_preprocessing[ereg]'",
+    ),
+    "FireANTsRegistrator": (
+        ".FireANTs.FireANTs",
+        "FireANTs package not found. If you want to use it, please install it using 'pip install brainles_preprocessing[fireants]'",
+    ),
+}
 
+__all__ = [
+    "ANTsRegistrator",
+    "CachedRegistrator",
+    "eRegRegistrator",
+    "FireANTsRegistrator",
+    "NiftyRegRegistrator",
+    "set_itk_threads",
+]
 
-from .niftyreg.niftyreg import NiftyRegRegistrator
+
+def __getattr__(name: str):
+    if name not in _OPTIONAL_REGISTRATORS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module_name, missing_message = _OPTIONAL_REGISTRATORS[name]
+    try:
+        module = importlib.import_module(module_name, __name__)
+    except ImportError as error:
+        warnings.warn(missing_message)
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from error
+
+    registrator = getattr(module, name)
+    # later accesses are plain module attribute lookups
+    globals()[name] = registrator
+    return registrator
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
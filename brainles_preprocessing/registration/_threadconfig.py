@@ -0,0 +1,39 @@
+import os
+
+ITK_THREADS_ENV = "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"
+# registration walltime stops improving beyond roughly this many threads
+DEFAULT_MAX_ITK_THREADS = 6
+
+
+def set_itk_threads(num_threads: int) -> None:
+    """
+    Set the number of threads used by ITK (and thereby ANTs and eReg).
+
+    ITK reads the setting once, so this has to be called before the first registration in the process.
+
+    Args:
+        num_threads (int): Number of threads.
+    """
+    os.environ[ITK_THREADS_ENV] = str(num_threads)
+
+
+def set_default_itk_threads() -> None:
+    """
+    Limit ITK to min(6, cpu count) threads unless ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS is already set.
+
+    Called when an ITK based registrator is configured, so merely importing the package leaves ITK untouched.
+    """
+    os.environ.setdefault(
+        ITK_THREADS_ENV, str(min(DEFAULT_MAX_ITK_THREADS, os.cpu_count() or 1))
+    )
+
+
+def set_worker_threads(num_threads: int) -> None:
+    """
+    Limit the threads of a worker process running registrations, for ITK and OpenMP based tools (e.g. NiftyReg).
+
+    Args:
+        num_threads (int): Number of threads.
+    """
+    set_itk_threads(num_threads)
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import file_digest
+
+
+def _default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache_home) / "brainles_preprocessing" / "registrations"
+
+
+def _nifti_suffix(image_path: Any) -> str:
+    if str(image_path).endswith(".nii.gz"):
+        return ".nii.gz"
+    return Path(image_path).suffix
+
+
+class CachedRegistrator(Registrator):
+    def __init__(
+        self,
+        registrator: Registrator,
+        cache_dir: Optional[str | Path] = None,
+    ):
+        """
+        Wrap a registrator so registrations of the same images with the same settings are only computed once.
+
+        Results are stored on disk and keyed by the content of the fixed and moving image and the
+        `registration_settings` of the wrapped registrator, so they are reused across pipeline runs.
+        Transformations are never cached.
+
+        Args:
+            registrator (Registrator): The registrator computing the registrations.
+            cache_dir (str | Path, optional): Directory of the cache. Defaults to None, which uses
+                "$XDG_CACHE_HOME/brainles_preprocessing/registrations" (XDG_CACHE_HOME defaults to "~/.cache").
+        """
+        self.registrator = registrator
+        self.cache_dir = Path(cache_dir) if cache_dir else _default_cache_dir()
+
+    def preload_image(self, image_path: Any) -> Any:
+        return self.registrator.preload_image(image_path)
+
+    def matrix_file_path(self, matrix_path: Any) -> str:
+        return self.registrator.matrix_file_path(matrix_path)
+
+    def registration_settings(self) -> Tuple:
+        return self.registrator.registration_settings()
+
+    def register(
+        self,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ) -> None:
+        """
+        Register images with the wrapped registrator, or copy the results of an identical earlier registration.
+
+        Args:
+            fixed_image_path (Any): Path to the fixed image.
+            moving_image_path (Any): Path to the moving image.
+            transformed_image_path (Any): Path to the transformed image (output).
+            matrix_path (Any): Path to the transformation matrix (output), see `matrix_file_path`.
+            log_file_path (str): Path to the log file, only written if the registration is computed.
+        """
+        self._register_cached(
+            fixed_image=None,
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def register_preloaded(
+        self,
+        fixed_image: Any,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ) -> None:
+        self._register_cached(
+            fixed_image=fixed_image,
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def transform(
+        self,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ) -> None:
+        self.registrator.transform(
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def transform_preloaded(
+        self,
+        fixed_image: Any,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ) -> None:
+        self.registrator.transform_preloaded(
+            fixed_image=fixed_image,
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def _register_cached(
+        self,
+        fixed_image: Any,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ) -> None:
+        transformed_suffix = _nifti_suffix(transformed_image_path)
+        entry = self.cache_dir / self._cache_key(
+            fixed_image_path, moving_image_path, transformed_suffix
+        )
+        # the cached outputs are named like the outputs of a registration into the entry directory
+        cached_transformed = entry / f"transformed{transformed_suffix}"
+        cached_matrix = Path(self.registrator.matrix_file_path(entry / "matrix"))
+
+        if not (cached_transformed.is_file() and cached_matrix.is_file()):
+            # an incomplete entry is computed again
+            shutil.rmtree(entry, ignore_errors=True)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            staging = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".staging-"))
+            try:
+                registration_args = dict(
+                    fixed_image_path=fixed_image_path,
+                    moving_image_path=moving_image_path,
+                    transformed_image_path=str(
+                        staging / f"transformed{transformed_suffix}"
+                    ),
+                    matrix_path=str(staging / "matrix"),
+                    log_file_path=log_file_path,
+                )
+                if fixed_image is None:
+                    self.registrator.register(**registration_args)
+                else:
+                    self.registrator.register_preloaded(
+                        fixed_image=fixed_image, **registration_args
+                    )
+                # publish the entry only once it is complete
+                os.rename(staging, entry)
+            except OSError:
+                # a concurrent run published the same entry first
+                if not entry.is_dir():
+                    raise
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        # copies rather than hard links, later steps modify the outputs in place
+        for cached, destination in (
+            (cached_transformed, str(transformed_image_path)),
+            (cached_matrix, self.registrator.matrix_file_path(matrix_path)),
+        ):
+            os.makedirs(Path(destination).parent, exist_ok=True)
+            shutil.copyfile(cached, destination)
+
+    def _cache_key(
+        self, fixed_image_path: Any, moving_image_path: Any, transformed_suffix: str
+    ) -> str:
+        key = (
+            file_digest(fixed_image_path),
+            file_digest(moving_image_path),
+            type(self.registrator).__qualname__,
+            self.registrator.registration_settings(),
+            transformed_suffix,
+        )
+        return hashlib.blake2b(repr(key).encode(), digest_size=20).hexdigest()
@@ -1,9 +1,17 @@
 # TODO add typing and docs
+import functools
 import os
+from typing import List, Tuple
 
 from ereg.registration import RegistrationClass
 
+from brainles_preprocessing.registration._threadconfig import set_default_itk_threads
 from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import (
+    check_and_add_suffix,
+    file_digest,
+    outputs_up_to_date,
+)
 
 
 class eRegRegistrator(Registrator):
@@ -11,11 +19,59 @@ class eRegRegistrator(Registrator):
         self,
         # TODO define default
         configuration_file: str | None = None,
+        reuse_outputs: bool = False,
     ):
         """
-        # TODO
+        Initialize the eRegRegistrator.
+
+        Args:
+            configuration_file (str, optional): Path to the eReg configuration file.
+            reuse_outputs (bool, optional): Skip registrations and transformations whose outputs are newer than
+                all of their inputs, including the configuration file. Defaults to False.
         """
         self.configuration_file = configuration_file
+        self.reuse_outputs = reuse_outputs
+
+        # ITK picks up its thread count before the first registration in the process
+        set_default_itk_threads()
+
+    def _outputs_up_to_date(
+        self, output_paths: List[str], input_paths: List[str]
+    ) -> bool:
+        if not self.reuse_outputs:
+            return False
+        if self.configuration_file is not None:
+            # changed registration parameters invalidate the outputs as well
+            input_paths = [*input_paths, self.configuration_file]
+        return outputs_up_to_date(output_paths=output_paths, input_paths=input_paths)
+
+    def _get_registration_class(self) -> RegistrationClass:
+        """
+        Get the eReg registration object for the configuration file, parsing the configuration only once.
+
+        Returns:
+            RegistrationClass: The (cached) eReg registration object.
+        """
+        # the modification time is part of the cache key, so edits to the configuration file are picked up
+        mtime_ns = (
+            os.stat(self.configuration_file).st_mtime_ns
+            if self.configuration_file is not None
+            else None
+        )
+        return _cached_registration_class(self.configuration_file, mtime_ns)
+
+    def matrix_file_path(self, matrix_path: str) -> str:
+        return check_and_add_suffix(matrix_path, ".mat")
+
+    def registration_settings(self) -> Tuple:
+        # the content of the configuration file, editing it changes the results
+        return (
+            (
+                file_digest(self.configuration_file)
+                if self.configuration_file is not None
+                else None
+            ),
+        )
 
     def register(
         self,
@@ -35,12 +91,15 @@ class eRegRegistrator(Registrator):
             matrix_path (str): Path to the transformation matrix (output).
             log_file_path (str): Path to the log file.
         """
-        # TODO do we need to handle kwargs?
-        registrator = RegistrationClass(
-            configuration_file=self.configuration_file,
-        )
+        matrix_path = check_and_add_suffix(matrix_path, ".mat")
+        if self._outputs_up_to_date(
+            output_paths=[matrix_path, transformed_image_path],
+            input_paths=[fixed_image_path, moving_image_path],
+        ):
+            return
 
-        matrix_path = _add_mat_suffix(matrix_path)
+        # TODO do we need to handle kwargs?
+        registrator = self._get_registration_class()
 
         registrator.register(
             target_image=fixed_image_path,
@@ -68,12 +127,15 @@ class eRegRegistrator(Registrator):
             matrix_path (str): Path to the transformation matrix.
             log_file_path (str): Path to the log file.
         """
-        # TODO do we need to handle kwargs?
-        registrator = RegistrationClass(
-            configuration_file=self.configuration_file,
-        )
+        matrix_path = check_and_add_suffix(matrix_path, ".mat")
+        if self._outputs_up_to_date(
+            output_paths=[transformed_image_path],
+            input_paths=[fixed_image_path, moving_image_path, matrix_path],
+        ):
+            return
 
-        matrix_path = _add_mat_suffix(matrix_path)
+        # TODO do we need to handle kwargs?
+        registrator = self._get_registration_class()
 
         registrator.resample_image(
             target_image=fixed_image_path,
@@ -84,17 +146,8 @@ class eRegRegistrator(Registrator):
         )
 
 
-def _add_mat_suffix(filename: str) -> str:
-    """
-    Adds a ".mat" suffix to the filename if it doesn't have any extension.
-
-    Parameters:
-        filename (str): The filename to check and potentially modify.
-
-    Returns:
-        str: The filename with ".mat" suffix added if needed.
-    """
-    base, ext = os.path.splitext(filename)
-    if not ext:
-        filename += ".mat"
-    return filename
+@functools.lru_cache(maxsize=4)
+def _cached_registration_class(
+    configuration_file: str | None, mtime_ns: int | None
+) -> RegistrationClass:
+    return RegistrationClass(configuration_file=configuration_file)
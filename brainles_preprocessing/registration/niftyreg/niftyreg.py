@@ -1,12 +1,22 @@
 import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
 
 from auxiliary.runscript import ScriptRunner
-from auxiliary.turbopath import turbopath
 
 from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import check_input_files, file_digest
 
 # from auxiliary import ScriptRunner
 
+_NIFTYREG_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "niftyreg_scripts"
+)
+_REG_ALADIN = os.path.join(_NIFTYREG_DIR, "reg_aladin")
+_REG_RESAMPLE = os.path.join(_NIFTYREG_DIR, "reg_resample")
+
 
 class NiftyRegRegistrator(Registrator):
     def __init__(
@@ -14,6 +24,7 @@ class NiftyRegRegistrator(Registrator):
         registration_abspath: str = os.path.dirname(os.path.abspath(__file__)),
         registration_script: str | None = None,
         transformation_script: str | None = None,
+        num_threads: Optional[int] = None,
     ):
         """
         Initialize the NiftyRegRegistrator.
@@ -22,7 +33,16 @@ class NiftyRegRegistrator(Registrator):
             registration_abspath (str): Absolute path to the registration directory.
             registration_script (str, optional): Path to the registration script. If None, a default script will be used.
             transformation_script (str, optional): Path to the transformation script. If None, a default script will be used.
+            num_threads (int, optional): Number of OpenMP threads of each NiftyReg process. Defaults to None, which keeps
+                an already set OMP_NUM_THREADS and otherwise uses all cores. Concurrent batch registrations never use
+                more than their share of the cores.
         """
+        self.num_threads = num_threads
+
+        # the default scripts only wrap a single NiftyReg call, which is then run without a shell
+        self._run_directly = registration_script is None
+        self._transform_directly = transformation_script is None
+
         # Set default registration script
         if registration_script is None:
             self.registration_script = os.path.join(
@@ -39,6 +59,13 @@ class NiftyRegRegistrator(Registrator):
         else:
             self.transformation_script = transformation_script
 
+    def matrix_file_path(self, matrix_path: str) -> str:
+        return str(_with_txt_suffix(matrix_path))
+
+    def registration_settings(self) -> Tuple:
+        # a custom script may pass any options to reg_aladin
+        return (None if self._run_directly else file_digest(self.registration_script),)
+
     def register(
         self,
         fixed_image_path: str,
@@ -57,25 +84,120 @@ class NiftyRegRegistrator(Registrator):
             matrix_path (str): Path to the transformation matrix (output).
             log_file_path (str): Path to the log file.
         """
+        self._register(
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def register_batch(
+        self,
+        fixed_image_path: str,
+        moving_image_paths: List[str],
+        transformed_image_paths: List[str],
+        matrix_paths: List[str],
+        log_file_paths: List[str],
+        n_jobs: int = 1,
+    ) -> None:
+        """
+        Register several moving images to the same fixed image, running up to n_jobs NiftyReg processes at once.
+
+        Args:
+            fixed_image_path (str): Path to the fixed image shared by all registrations.
+            moving_image_paths (List[str]): Paths to the moving images.
+            transformed_image_paths (List[str]): Paths to the transformed images (output).
+            matrix_paths (List[str]): Paths to the transformation matrices (output), one per moving image.
+            log_file_paths (List[str]): Paths to the log files, one per moving image.
+            n_jobs (int, optional): Number of concurrent registrations. The available cores are split evenly
+                between them. Defaults to 1 (sequential).
+        """
+        if n_jobs <= 1 or not self._run_directly:
+            super().register_batch(
+                fixed_image_path=fixed_image_path,
+                moving_image_paths=moving_image_paths,
+                transformed_image_paths=transformed_image_paths,
+                matrix_paths=matrix_paths,
+                log_file_paths=log_file_paths,
+                n_jobs=n_jobs,
+            )
+            return
+
+        threads_per_job = max(1, (os.cpu_count() or 1) // n_jobs)
+        if self.num_threads is not None:
+            threads_per_job = min(threads_per_job, self.num_threads)
+        # the work happens in the reg_aladin processes, threads are enough to run them concurrently
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(
+                    self._register,
+                    fixed_image_path=fixed_image_path,
+                    moving_image_path=moving_image_path,
+                    transformed_image_path=transformed_image_path,
+                    matrix_path=matrix_path,
+                    log_file_path=log_file_path,
+                    num_threads=threads_per_job,
+                )
+                for (
+                    moving_image_path,
+                    transformed_image_path,
+                    matrix_path,
+                    log_file_path,
+                ) in zip(
+                    moving_image_paths,
+                    transformed_image_paths,
+                    matrix_paths,
+                    log_file_paths,
+                    strict=True,
+                )
+            ]
+            for future in futures:
+                future.result()
+
+    def _register(
+        self,
+        fixed_image_path: str,
+        moving_image_path: str,
+        transformed_image_path: str,
+        matrix_path: str,
+        log_file_path: str,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        # num_threads overrides the thread count of the registrator for a single call
+        matrix_path = _with_txt_suffix(matrix_path)
+
+        if self._run_directly:
+            check_input_files(fixed_image_path, moving_image_path)
+            _run_logged(
+                command=[
+                    _REG_ALADIN,
+                    "-rigOnly",
+                    "-ref",
+                    str(fixed_image_path),
+                    "-flo",
+                    str(moving_image_path),
+                    "-res",
+                    str(transformed_image_path),
+                    "-aff",
+                    str(matrix_path),
+                ],
+                log_file_path=log_file_path,
+                num_threads=num_threads or self.num_threads,
+            )
+            return
+
         runner = ScriptRunner(
             script_path=self.registration_script,
             log_path=log_file_path,
         )
 
-        niftyreg_executable = str(
-            turbopath(__file__).parent + "/niftyreg_scripts/reg_aladin",
-        )
-
-        turbopath(matrix_path)
-        if matrix_path.suffix != ".txt":
-            matrix_path = matrix_path.with_suffix(".txt")
-
         input_params = [
-            turbopath(niftyreg_executable),
-            turbopath(fixed_image_path),
-            turbopath(moving_image_path),
-            turbopath(transformed_image_path),
-            turbopath(matrix_path),
+            _REG_ALADIN,
+            str(fixed_image_path),
+            str(moving_image_path),
+            str(transformed_image_path),
+            str(matrix_path),
         ]
 
         # Call the run method to execute the script and capture the output in the log file
@@ -104,25 +226,40 @@ class NiftyRegRegistrator(Registrator):
             matrix_path (str): Path to the transformation matrix.
             log_file_path (str): Path to the log file.
         """
+        matrix_path = _with_txt_suffix(matrix_path)
+
+        if self._transform_directly:
+            check_input_files(fixed_image_path, moving_image_path, matrix_path)
+            _run_logged(
+                command=[
+                    _REG_RESAMPLE,
+                    "-ref",
+                    str(fixed_image_path),
+                    "-flo",
+                    str(moving_image_path),
+                    "-trans",
+                    str(matrix_path),
+                    "-res",
+                    str(transformed_image_path),
+                    "-inter",
+                    "3",
+                ],
+                log_file_path=log_file_path,
+                num_threads=self.num_threads,
+            )
+            return
+
         runner = ScriptRunner(
             script_path=self.transformation_script,
             log_path=log_file_path,
         )
 
-        niftyreg_executable = str(
-            turbopath(__file__).parent + "/niftyreg_scripts/reg_resample",
-        )
-
-        turbopath(matrix_path)
-        if matrix_path.suffix != ".txt":
-            matrix_path = matrix_path.with_suffix(".txt")
-
         input_params = [
-            turbopath(niftyreg_executable),
-            turbopath(fixed_image_path),
-            turbopath(moving_image_path),
-            turbopath(transformed_image_path),
-            turbopath(matrix_path),
+            _REG_RESAMPLE,
+            str(fixed_image_path),
+            str(moving_image_path),
+            str(transformed_image_path),
+            str(matrix_path),
             # we need to add txt as this is the format for niftyreg matrixes
         ]
 
@@ -133,3 +270,43 @@ class NiftyRegRegistrator(Registrator):
         #     print("Script executed successfully. Check the log file for details.")
         # else:
         #     print("Script execution failed:", error)
+
+
+def _with_txt_suffix(matrix_path: str | Path) -> Path:
+    """
+    Replace (or add) the suffix of a matrix path with ".txt", the format of NiftyReg matrices.
+
+    Args:
+        matrix_path (str | Path): Path to the transformation matrix.
+
+    Returns:
+        Path: The matrix path ending in ".txt".
+    """
+    matrix_path = Path(matrix_path)
+    if matrix_path.suffix != ".txt":
+        matrix_path = matrix_path.with_suffix(".txt")
+    return matrix_path
+
+
+def _run_logged(
+    command: List[str], log_file_path: str, num_threads: Optional[int] = None
+) -> None:
+    """
+    Run a NiftyReg executable, writing its output to a log file.
+
+    Args:
+        command (List[str]): The executable followed by its arguments.
+        log_file_path (str): Path to the log file.
+        num_threads (int, optional): Number of OpenMP threads of the process. Defaults to None (inherited setting).
+
+    Raises:
+        subprocess.CalledProcessError: If NiftyReg fails, its output is in the log file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(log_file_path)), exist_ok=True)
+    env = None
+    if num_threads is not None:
+        env = {**os.environ, "OMP_NUM_THREADS": str(num_threads)}
+    with open(log_file_path, "w") as log_file:
+        subprocess.run(
+            command, stdout=log_file, stderr=subprocess.STDOUT, env=env, check=True
+        )
@@ -1,5 +1,10 @@
+import multiprocessing
+import os
 from abc import ABC, abstractmethod
-from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Tuple
+
+from brainles_preprocessing.registration._threadconfig import set_worker_threads
 
 
 class Registrator(ABC):
@@ -49,3 +54,199 @@ class Registrator(ABC):
 
         """
         pass
+
+    @abstractmethod
+    def registration_settings(self) -> Tuple:
+        """
+        Abstract method for getting the settings that determine the results of `register`.
+
+        They key cached results (see `CachedRegistrator`). Configuration files are represented by a digest
+        of their content, not by their path.
+
+        Returns:
+            Tuple: The settings, their repr has to be stable across processes.
+        """
+        pass
+
+    def preload_image(self, image_path: Any) -> Any:
+        """
+        Read an image once so it can be shared by several registrations against it.
+
+        Backends that only operate on file paths do not support preloading and return None.
+
+        Args:
+            image_path (Any): Path to the image.
+
+        Returns:
+            Any: The decoded image for `register_preloaded`, or None if unsupported.
+        """
+        return None
+
+    def matrix_file_path(self, matrix_path: Any) -> str:
+        """
+        Get the path the backend writes the transformation matrix to, e.g. with the backend's suffix added.
+
+        Args:
+            matrix_path (Any): The matrix path passed to `register`.
+
+        Returns:
+            str: The path of the written matrix file.
+        """
+        return str(matrix_path)
+
+    def register_preloaded(
+        self,
+        fixed_image: Any,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ):
+        """
+        Register images using a fixed image returned by `preload_image`.
+
+        Backends without preloading ignore the preloaded image and register from the file paths.
+
+        Args:
+            fixed_image (Any): The preloaded fixed image.
+            fixed_image_path (Any): Path the fixed image was read from.
+            moving_image_path (Any): The moving image to be registered.
+            transformed_image_path (Any): The resulting transformed image after registration.
+            matrix_path (Any): The transformation matrix applied during registration.
+            log_file_path (str): The path to the log file for recording registration details.
+        """
+        self.register(
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def transform_preloaded(
+        self,
+        fixed_image: Any,
+        fixed_image_path: Any,
+        moving_image_path: Any,
+        transformed_image_path: Any,
+        matrix_path: Any,
+        log_file_path: str,
+    ):
+        """
+        Transform images using a fixed image returned by `preload_image`.
+
+        Backends without preloading ignore the preloaded image and transform from the file paths.
+
+        Args:
+            fixed_image (Any): The preloaded fixed image.
+            fixed_image_path (Any): Path the fixed image was read from.
+            moving_image_path (Any): The moving image to be transformed.
+            transformed_image_path (Any): The resulting transformed image.
+            matrix_path (Any): The transformation matrix applied during transformation.
+            log_file_path (str): The path to the log file for recording transformation details.
+        """
+        self.transform(
+            fixed_image_path=fixed_image_path,
+            moving_image_path=moving_image_path,
+            transformed_image_path=transformed_image_path,
+            matrix_path=matrix_path,
+            log_file_path=log_file_path,
+        )
+
+    def register_batch(
+        self,
+        fixed_image_path: Any,
+        moving_image_paths: List[Any],
+        transformed_image_paths: List[Any],
+        matrix_paths: List[Any],
+        log_file_paths: List[str],
+        n_jobs: int = 1,
+    ):
+        """
+        Register several moving images to the same fixed image, reading the fixed image only once if the backend supports it.
+
+        Args:
+            fixed_image_path (Any): The fixed image shared by all registrations.
+            moving_image_paths (List[Any]): The moving images to be registered.
+            transformed_image_paths (List[Any]): The resulting transformed images.
+            matrix_paths (List[Any]): The resulting transformation matrices, one per moving image.
+            log_file_paths (List[str]): The paths to the log files, one per moving image.
+            n_jobs (int, optional): Number of registrations to run in parallel worker processes.
+                The available cores are split evenly between the workers. Defaults to 1 (sequential).
+        """
+        if n_jobs > 1:
+            self._register_in_processes(
+                fixed_image_path=fixed_image_path,
+                moving_image_paths=moving_image_paths,
+                transformed_image_paths=transformed_image_paths,
+                matrix_paths=matrix_paths,
+                log_file_paths=log_file_paths,
+                n_jobs=n_jobs,
+            )
+            return
+
+        fixed_image = self.preload_image(fixed_image_path)
+        for (
+            moving_image_path,
+            transformed_image_path,
+            matrix_path,
+            log_file_path,
+        ) in zip(
+            moving_image_paths,
+            transformed_image_paths,
+            matrix_paths,
+            log_file_paths,
+            strict=True,
+        ):
+            self.register_preloaded(
+                fixed_image=fixed_image,
+                fixed_image_path=fixed_image_path,
+                moving_image_path=moving_image_path,
+                transformed_image_path=transformed_image_path,
+                matrix_path=matrix_path,
+                log_file_path=log_file_path,
+            )
+
+    def _register_in_processes(
+        self,
+        fixed_image_path: Any,
+        moving_image_paths: List[Any],
+        transformed_image_paths: List[Any],
+        matrix_paths: List[Any],
+        log_file_paths: List[str],
+        n_jobs: int,
+    ):
+        threads_per_job = max(1, (os.cpu_count() or 1) // n_jobs)
+        # spawn fresh workers so the thread settings are not inherited from this process
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=set_worker_threads,
+            initargs=(threads_per_job,),
+        ) as executor:
+            # workers only receive paths, each reads the fixed image itself
+            futures = [
+                executor.submit(
+                    self.register,
+                    fixed_image_path=fixed_image_path,
+                    moving_image_path=moving_image_path,
+                    transformed_image_path=transformed_image_path,
+                    matrix_path=matrix_path,
+                    log_file_path=log_file_path,
+                )
+                for (
+                    moving_image_path,
+                    transformed_image_path,
+                    matrix_path,
+                    log_file_path,
+                ) in zip(
+                    moving_image_paths,
+                    transformed_image_paths,
+                    matrix_paths,
+                    log_file_paths,
+                    strict=True,
+                )
+            ]
+            for future in futures:
+                future.result()
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# ioctl request code for a copy-on-write clone of a whole file (Linux, see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+
+def fast_copy(src: str | Path, dst: str | Path) -> None:
+    """
+    Copy a file without duplicating its data whenever the filesystem allows it.
+
+    Tries a copy-on-write reflink (``FICLONE``) and falls back to a regular byte copy. Hardlinks are never used,
+    the copy is an independent file, so writing to it never changes the source (e.g. a user's input image).
+
+    Args:
+        src (str | Path): Path to the source file.
+        dst (str | Path): Path to the destination file, an existing file is replaced.
+    """
+    src, dst = str(src), str(dst)
+    if os.path.realpath(src) == os.path.realpath(dst):
+        return
+    if os.path.isfile(dst) and os.path.samefile(src, dst):
+        # a hardlink to the source, writing into it would modify the source as well
+        os.unlink(dst)
+
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            # e.g. EOPNOTSUPP (no reflinks) or EXDEV (different filesystems)
+            pass
+
+    shutil.copyfile(src, dst)
+
+
+def gzip_copy(src: str | Path, dst: str | Path, compresslevel: int = 6) -> None:
+    """
+    Copy a file and gzip-compress it on the way, e.g. an uncompressed intermediate ".nii" to a final ".nii.gz".
+
+    Args:
+        src (str | Path): Path to the (uncompressed) source file.
+        dst (str | Path): Path to the compressed destination file.
+        compresslevel (int, optional): gzip compression level (1-9), defaults to 6 (zlib's default, as used by ITK).
+    """
+    with open(src, "rb") as fsrc, gzip.open(
+        dst, "wb", compresslevel=compresslevel
+    ) as fdst:
+        shutil.copyfileobj(fsrc, fdst, length=1 << 20)
+
+
+def copy_nifti(src: str | Path, dst: str | Path, compresslevel: int = 6) -> None:
+    """
+    Copy a NIfTI file, compressing it if an uncompressed ".nii" is copied to a ".nii.gz" destination.
+
+    Args:
+        src (str | Path): Path to the source NIfTI file.
+        dst (str | Path): Path to the destination NIfTI file.
+        compresslevel (int, optional): gzip compression level (1-9) used when compressing, defaults to 6.
+    """
+    if str(src).endswith(".nii") and str(dst).endswith(".nii.gz"):
+        gzip_copy(src=src, dst=dst, compresslevel=compresslevel)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def check_and_add_suffix(filename: str | Path, suffix: str) -> str:
+    """
+    Add a suffix to a filename unless it already ends with it.
+
+    Args:
+        filename (str | Path): The filename to check.
+        suffix (str): The suffix, e.g. ".mat".
+
+    Returns:
+        str: The filename ending with the suffix.
+    """
+    filename = str(filename)
+    return filename if filename.endswith(suffix) else filename + suffix
+
+
+def check_input_files(*paths: str | Path) -> None:
+    """
+    Fail early with a clear error if an input file is missing, before any image is decoded.
+
+    Args:
+        *paths (str | Path): Paths of the required input files.
+
+    Raises:
+        FileNotFoundError: If one of the files does not exist.
+    """
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Input file not found: {path}")
+
+
+def file_digest(path: str | Path) -> str:
+    """
+    Hash the content of a file, reading it in chunks.
+
+    Args:
+        path (str | Path): Path to the file.
+
+    Returns:
+        str: The hex digest (blake2b) of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def outputs_up_to_date(
+    output_paths: Iterable[str | Path], input_paths: Iterable[str | Path]
+) -> bool:
+    """
+    Check whether all outputs exist and are at least as recent as all inputs, so recomputing them can be skipped.
+
+    Args:
+        output_paths (Iterable[str | Path]): Paths of the outputs.
+        input_paths (Iterable[str | Path]): Paths of the inputs the outputs were computed from.
+
+    Returns:
+        bool: True if all outputs exist and none of them is older than any input.
+    """
+    try:
+        oldest_output = min(os.path.getmtime(path) for path in output_paths)
+    except (FileNotFoundError, ValueError):
+        # a missing output or no outputs at all
+        return False
+    return oldest_output >= max(
+        (os.path.getmtime(path) for path in input_paths), default=0
+    )
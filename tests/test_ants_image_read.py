@@ -0,0 +1,67 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import ants
+import nibabel as nib
+import numpy as np
+from auxiliary.turbopath import turbopath
+
+from brainles_preprocessing.registration.ANTs.ANTs import _fast_image_read
+
+
+class TestFastImageRead(unittest.TestCase):
+    def setUp(self):
+        self.input_dir = turbopath(__file__).parent + "/test_data/input"
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def decompress(self, name):
+        uncompressed = os.path.join(self.output_dir, name.replace(".nii.gz", ".nii"))
+        with gzip.open(self.input_dir + f"/{name}", "rb") as src, open(
+            uncompressed, "wb"
+        ) as dst:
+            shutil.copyfileobj(src, dst)
+        return uncompressed
+
+    def assert_matches_image_read(self, path):
+        expected = ants.image_read(path)
+        image = _fast_image_read(path)
+
+        np.testing.assert_allclose(image.origin, expected.origin, atol=1e-4)
+        np.testing.assert_allclose(image.spacing, expected.spacing, atol=1e-5)
+        np.testing.assert_allclose(image.direction, expected.direction, atol=1e-5)
+        np.testing.assert_array_equal(image.numpy(), expected.numpy())
+
+    def test_matches_image_read_t1(self):
+        self.assert_matches_image_read(self.decompress("tcia_example_t1.nii.gz"))
+
+    def test_matches_image_read_t1c(self):
+        self.assert_matches_image_read(self.decompress("tcia_example_t1c.nii.gz"))
+
+    def test_matches_image_read_oblique(self):
+        image = nib.load(self.decompress("tcia_example_t1.nii.gz"))
+        angle = np.deg2rad(15)
+        rotation = np.eye(4)
+        rotation[:2, :2] = [
+            [np.cos(angle), -np.sin(angle)],
+            [np.sin(angle), np.cos(angle)],
+        ]
+        oblique = nib.Nifti1Image(
+            np.asarray(image.dataobj), rotation @ image.affine, image.header
+        )
+        path = os.path.join(self.output_dir, "oblique.nii")
+        nib.save(oblique, path)
+
+        self.assert_matches_image_read(path)
+
+    def test_compressed_matches_image_read(self):
+        self.assert_matches_image_read(self.input_dir + "/tcia_example_t1.nii.gz")
+
+
+if __name__ == "__main__":
+    unittest.main()
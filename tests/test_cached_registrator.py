@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from brainles_preprocessing.registration.cached_registrator import CachedRegistrator
+from brainles_preprocessing.registration.registrator import Registrator
+from brainles_preprocessing.utils import file_digest
+
+
+class FakeRegistrator(Registrator):
+    """Writes the configuration into its outputs and counts the registrations it computes."""
+
+    def __init__(self, configuration_file):
+        self.configuration_file = configuration_file
+        self.register_calls = 0
+
+    def matrix_file_path(self, matrix_path):
+        # replaces the suffix, like ANTs and NiftyReg do
+        return str(Path(matrix_path).with_suffix(".txt"))
+
+    def registration_settings(self):
+        return (file_digest(self.configuration_file),)
+
+    def register(
+        self,
+        fixed_image_path,
+        moving_image_path,
+        transformed_image_path,
+        matrix_path,
+        log_file_path,
+    ):
+        self.register_calls += 1
+        configuration = Path(self.configuration_file).read_text()
+        Path(transformed_image_path).write_text(f"transformed {configuration}")
+        Path(self.matrix_file_path(matrix_path)).write_text(f"matrix {configuration}")
+
+    def transform(
+        self,
+        fixed_image_path,
+        moving_image_path,
+        transformed_image_path,
+        matrix_path,
+        log_file_path,
+    ):
+        pass
+
+
+class TestCachedRegistrator(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.fixed_image = os.path.join(self.temp_dir, "fixed.nii.gz")
+        self.moving_image = os.path.join(self.temp_dir, "moving.nii.gz")
+        Path(self.fixed_image).write_bytes(b"fixed")
+        Path(self.moving_image).write_bytes(b"moving")
+        self.configuration_file = os.path.join(self.temp_dir, "config.yaml")
+        Path(self.configuration_file).write_text("rigid")
+
+        self.backend = FakeRegistrator(configuration_file=self.configuration_file)
+        self.registrator = CachedRegistrator(
+            registrator=self.backend,
+            cache_dir=os.path.join(self.temp_dir, "cache"),
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def register(self, name):
+        output_dir = os.path.join(self.temp_dir, name)
+        transformed_image = os.path.join(output_dir, "registered.nii.gz")
+        # a dotted name, the backend replaces its suffix
+        matrix = os.path.join(output_dir, "co__t1c.t1")
+        self.registrator.register(
+            fixed_image_path=self.fixed_image,
+            moving_image_path=self.moving_image,
+            transformed_image_path=transformed_image,
+            matrix_path=matrix,
+            log_file_path=os.path.join(self.temp_dir, f"{name}.log"),
+        )
+        return transformed_image, os.path.join(output_dir, "co__t1c.txt")
+
+    def test_miss_computes_registration(self):
+        transformed_image, matrix = self.register("first")
+
+        self.assertEqual(self.backend.register_calls, 1)
+        self.assertEqual(Path(transformed_image).read_text(), "transformed rigid")
+        self.assertEqual(Path(matrix).read_text(), "matrix rigid")
+
+    def test_hit_restores_outputs(self):
+        self.register("first")
+        transformed_image, matrix = self.register("second")
+
+        self.assertEqual(self.backend.register_calls, 1)
+        self.assertEqual(Path(transformed_image).read_text(), "transformed rigid")
+        self.assertEqual(Path(matrix).read_text(), "matrix rigid")
+
+    def test_restored_outputs_are_copies(self):
+        self.register("first")
+        transformed_image, _ = self.register("second")
+        Path(transformed_image).write_text("modified")
+
+        transformed_image, _ = self.register("third")
+        self.assertEqual(Path(transformed_image).read_text(), "transformed rigid")
+
+    def test_configuration_change_computes_registration(self):
+        self.register("first")
+        Path(self.configuration_file).write_text("affine")
+        transformed_image, matrix = self.register("second")
+
+        self.assertEqual(self.backend.register_calls, 2)
+        self.assertEqual(Path(transformed_image).read_text(), "transformed affine")
+        self.assertEqual(Path(matrix).read_text(), "matrix affine")
+
+    def test_image_change_computes_registration(self):
+        self.register("first")
+        Path(self.moving_image).write_bytes(b"other moving")
+        self.register("second")
+
+        self.assertEqual(self.backend.register_calls, 2)
+
+    def test_incomplete_entry_computes_registration(self):
+        self.register("first")
+        for entry in Path(self.registrator.cache_dir).iterdir():
+            Path(self.backend.matrix_file_path(entry / "matrix")).unlink()
+            (entry / "stray").mkdir()
+        _, matrix = self.register("second")
+
+        self.assertEqual(self.backend.register_calls, 2)
+        self.assertEqual(Path(matrix).read_text(), "matrix rigid")
+
+
+class TestRegistrationSettings(unittest.TestCase):
+    def test_registrator_without_settings_cannot_be_created(self):
+        class UndeclaredRegistrator(Registrator):
+            def register(self, *args, **kwargs):
+                pass
+
+            def transform(self, *args, **kwargs):
+                pass
+
+        with self.assertRaises(TypeError):
+            UndeclaredRegistrator()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from brainles_preprocessing.registration.ANTs.ANTs import _with_mat_suffix
+from brainles_preprocessing.registration.niftyreg.niftyreg import _with_txt_suffix
+
+try:
+    # the script imports flask_socketio, which is not a dependency of the package
+    from brainles_preprocessing.registration.ANTs import TODO_ANTs_parameters
+    from brainles_preprocessing.registration.ANTs.TODO_ANTs_parameters import (
+        Stage,
+        ants_call_template,
+        fireants_registrator,
+    )
+
+    ANTS_PARAMETERS_AVAILABLE = True
+except ImportError:
+    ANTS_PARAMETERS_AVAILABLE = False
+
+
+class TestWithMatSuffix(unittest.TestCase):
+    def test_adds_suffix(self):
+        self.assertEqual(_with_mat_suffix("out/matrix"), "out/matrix.mat")
+
+    def test_keeps_suffix(self):
+        self.assertEqual(_with_mat_suffix("out/matrix.mat"), "out/matrix.mat")
+
+    def test_replaces_suffix(self):
+        self.assertEqual(_with_mat_suffix("out/co__t1c.t1"), "out/co__t1c.mat")
+
+    def test_dotted_directory(self):
+        self.assertEqual(_with_mat_suffix("out.d/matrix"), "out.d/matrix.mat")
+
+    def test_hidden_file(self):
+        self.assertEqual(_with_mat_suffix("out/.matrix"), "out/.matrix.mat")
+
+    def test_matches_pathlib(self):
+        for matrix_path in ["out/co__t1c.t1", "out.d/matrix", "out/.matrix"]:
+            self.assertEqual(
+                _with_mat_suffix(matrix_path),
+                str(Path(matrix_path).with_suffix(".mat")),
+            )
+
+    def test_accepts_path(self):
+        self.assertEqual(
+            _with_mat_suffix(Path("out") / "matrix"), os.path.join("out", "matrix.mat")
+        )
+
+
+class TestWithTxtSuffix(unittest.TestCase):
+    def test_adds_suffix(self):
+        self.assertEqual(_with_txt_suffix("out/matrix"), Path("out/matrix.txt"))
+
+    def test_keeps_suffix(self):
+        self.assertEqual(_with_txt_suffix("out/matrix.txt"), Path("out/matrix.txt"))
+
+    def test_replaces_suffix(self):
+        self.assertEqual(_with_txt_suffix("out/co__t1c.t1"), Path("out/co__t1c.txt"))
+
+
+@unittest.skipUnless(ANTS_PARAMETERS_AVAILABLE, "flask_socketio is not installed")
+class TestStage(unittest.TestCase):
+    def test_with_halved_shrink(self):
+        stage = Stage("rigid[0.1]", "Regular,0.1", "[50x25,1e-5,5]", "4x0", "4x3x2x1")
+
+        halved = stage.with_halved_shrink()
+
+        self.assertEqual(halved.shrink, "2x2x1x1")
+        self.assertEqual(halved.transform, stage.transform)
+        self.assertEqual(stage.shrink, "4x3x2x1")
+
+    def test_with_halved_shrink_single_level(self):
+        stage = Stage("translation[0.1]", "Regular,0.05", "[1000,1e-8,20]", "4vox", "6")
+        self.assertEqual(stage.with_halved_shrink().shrink, "3")
+
+    def test_to_args(self):
+        stage = Stage("rigid[0.1]", "Regular,0.1", "[50x25,1e-5,5]", "4x0", "4x2")
+        self.assertEqual(
+            stage.to_args("fixed", "moving", 16),
+            [
+                *["-t", "rigid[0.1]"],
+                *["-m", "Mattes[fixed,moving,1,16,Regular,0.1]"],
+                *["-c", "[50x25,1e-5,5]"],
+                *["-s", "4x0"],
+                *["-f", "4x2"],
+            ],
+        )
+
+
+@unittest.skipUnless(ANTS_PARAMETERS_AVAILABLE, "flask_socketio is not installed")
+class TestAntsCallTemplate(unittest.TestCase):
+    def template(self, algorithm="rigid", presampled=False):
+        return ants_call_template(
+            algorithm, "Regular,0.1", 16, "Linear", presampled=presampled
+        )
+
+    def shrink_factors(self, template):
+        return [template[i + 1] for i, arg in enumerate(template) if arg == "-f"]
+
+    def test_placeholders(self):
+        template = self.template()
+
+        self.assertEqual(template[0], "antsRegistration")
+        self.assertIn("[{f},{m},0]", template)
+        self.assertIn("Mattes[{f},{m},1,16,Regular,0.1]", template)
+        self.assertIn("[{o}]", template)
+        call = [arg.format(f="fixed", m="moving", o="out") for arg in template]
+        self.assertIn("[out]", call)
+
+    def test_stages(self):
+        self.assertEqual(self.template("rigid").count("-t"), 1)
+        self.assertEqual(self.template("rigid+affine").count("-t"), 2)
+        self.assertEqual(self.template("rex-dfc").count("-t"), 3)
+
+    def test_presampled_halves_shrink_factors(self):
+        self.assertEqual(self.shrink_factors(self.template()), ["4x3x2x1"])
+        self.assertEqual(
+            self.shrink_factors(self.template(presampled=True)), ["2x2x1x1"]
+        )
+
+    def test_cached(self):
+        self.assertIs(self.template(), self.template())
+
+    def test_unknown_algorithm(self):
+        with self.assertRaisesRegex(ValueError, "bspline"):
+            self.template("bspline")
+
+
+@unittest.skipUnless(ANTS_PARAMETERS_AVAILABLE, "flask_socketio is not installed")
+class TestFireantsRegistrator(unittest.TestCase):
+    def setUp(self):
+        self.registrator = mock.Mock()
+        patcher = mock.patch.object(
+            TODO_ANTs_parameters,
+            "_load_fireants_registrator",
+            return_value=self.registrator,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def register(self, fixed_image, moving_image):
+        images = {"fixed.nii.gz": fixed_image, "moving.nii.gz": moving_image}
+        with mock.patch.object(
+            TODO_ANTs_parameters, "load_fireants_image", side_effect=images.get
+        ):
+            return fireants_registrator(
+                "fixed.nii.gz", "moving.nii.gz", "out/t1c_to_t1_"
+            )
+
+    def test_saves_ants_transform(self):
+        fixed_image, moving_image = object(), object()
+
+        self.assertTrue(self.register(fixed_image, moving_image))
+        self.registrator.estimate_transforms.assert_called_once_with(
+            fixed_image=fixed_image,
+            moving_images=[moving_image],
+            matrix_paths=["out/t1c_to_t1_0GenericAffine.mat"],
+        )
+
+    def test_unreadable_moving_image_falls_back(self):
+        self.assertFalse(self.register(object(), None))
+        self.registrator.estimate_transforms.assert_not_called()
+
+    def test_unreadable_fixed_image_falls_back(self):
+        self.assertFalse(self.register(None, object()))
+        self.registrator.estimate_transforms.assert_not_called()
+
+    def test_deformable_algorithm_falls_back(self):
+        self.assertFalse(
+            fireants_registrator(
+                "fixed.nii.gz", "moving.nii.gz", "out/t1c_to_t1_", "rex-dfc"
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+from auxiliary.turbopath import turbopath
 from registrator_base import RegistratorBase
 
 from brainles_preprocessing.registration.ANTs.ANTs import ANTsRegistrator
@@ -6,6 +7,17 @@ from brainles_preprocessing.registration.niftyreg.niftyreg import NiftyRegRegist
 
 import unittest
 
+try:
+    import torch
+
+    from brainles_preprocessing.registration.FireANTs.FireANTs import (
+        FireANTsRegistrator,
+    )
+
+    FIREANTS_AVAILABLE = torch.cuda.is_available()
+except ImportError:
+    FIREANTS_AVAILABLE = False
+
 
 class TestANTsRegistrator(RegistratorBase, unittest.TestCase):
     def get_registrator(self):
@@ -29,3 +41,19 @@ class TestEregRegistratorRegistrator(RegistratorBase, unittest.TestCase):
 
     def get_method_and_extension(self):
         return "ereg", "mat"
+
+
+@unittest.skipUnless(FIREANTS_AVAILABLE, "fireants or a CUDA device is not available")
+class TestFireANTsRegistrator(RegistratorBase, unittest.TestCase):
+    def get_registrator(self):
+        return FireANTsRegistrator()
+
+    def get_method_and_extension(self):
+        return "fireants", "mat"
+
+    def setUp(self):
+        super().setUp()
+        # FireANTs applies ITK transforms, e.g. the one written by ANTs
+        self.transform_matrix = (
+            turbopath(__file__).parent + "/test_data/input/ants_matrix"
+        )
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from brainles_preprocessing.registration._threadconfig import (
+    ITK_THREADS_ENV,
+    set_default_itk_threads,
+)
+
+
+class TestSetDefaultItkThreads(unittest.TestCase):
+    def test_sets_default(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop(ITK_THREADS_ENV, None)
+            set_default_itk_threads()
+
+            self.assertEqual(
+                os.environ[ITK_THREADS_ENV], str(min(6, os.cpu_count() or 1))
+            )
+
+    def test_keeps_existing_setting(self):
+        with mock.patch.dict(os.environ, {ITK_THREADS_ENV: "13"}):
+            set_default_itk_threads()
+
+            self.assertEqual(os.environ[ITK_THREADS_ENV], "13")
+
+    def test_import_leaves_itk_untouched(self):
+        env = {
+            key: value for key, value in os.environ.items() if key != ITK_THREADS_ENV
+        }
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import os, brainles_preprocessing.registration;"
+                f"print(os.environ.get({ITK_THREADS_ENV!r}))",
+            ],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        self.assertEqual(result.stdout.strip(), "None")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from brainles_preprocessing.utils import (
+    check_and_add_suffix,
+    check_input_files,
+    copy_nifti,
+    fast_copy,
+    file_digest,
+    outputs_up_to_date,
+)
+
+
+class TestCheckAndAddSuffix(unittest.TestCase):
+    def test_adds_missing_suffix(self):
+        self.assertEqual(check_and_add_suffix("out/matrix", ".mat"), "out/matrix.mat")
+
+    def test_keeps_existing_suffix(self):
+        self.assertEqual(
+            check_and_add_suffix("out/matrix.mat", ".mat"), "out/matrix.mat"
+        )
+
+    def test_appends_to_other_suffix(self):
+        self.assertEqual(
+            check_and_add_suffix("out/co__t1c.t1", ".mat"), "out/co__t1c.t1.mat"
+        )
+
+    def test_accepts_path(self):
+        self.assertEqual(
+            check_and_add_suffix(Path("out") / "matrix", ".mat"),
+            os.path.join("out", "matrix.mat"),
+        )
+
+
+class FileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, content=b"content", mtime=None):
+        path = os.path.join(self.temp_dir, name)
+        Path(path).write_bytes(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+
+class TestOutputsUpToDate(FileTestCase):
+    def test_newer_outputs(self):
+        inputs = [self.write("fixed", mtime=100), self.write("moving", mtime=200)]
+        outputs = [self.write("matrix", mtime=300), self.write("warped", mtime=200)]
+        self.assertTrue(outputs_up_to_date(outputs, inputs))
+
+    def test_older_output(self):
+        inputs = [self.write("fixed", mtime=100), self.write("moving", mtime=300)]
+        outputs = [self.write("matrix", mtime=400), self.write("warped", mtime=200)]
+        self.assertFalse(outputs_up_to_date(outputs, inputs))
+
+    def test_missing_output(self):
+        inputs = [self.write("fixed", mtime=100)]
+        outputs = [
+            self.write("matrix", mtime=200),
+            os.path.join(self.temp_dir, "warped"),
+        ]
+        self.assertFalse(outputs_up_to_date(outputs, inputs))
+
+    def test_no_outputs(self):
+        self.assertFalse(outputs_up_to_date([], [self.write("fixed")]))
+
+    def test_no_inputs(self):
+        self.assertTrue(outputs_up_to_date([self.write("matrix")], []))
+
+
+class TestFileDigest(FileTestCase):
+    def test_same_content(self):
+        first = self.write("a", b"image")
+        second = self.write("b", b"image")
+        self.assertEqual(file_digest(first), file_digest(second))
+
+    def test_different_content(self):
+        # the images only differ after the first chunk
+        first = self.write("a", b"\0" * (1 << 20) + b"a")
+        second = self.write("b", b"\0" * (1 << 20) + b"b")
+        self.assertNotEqual(file_digest(first), file_digest(second))
+
+
+class TestCheckInputFiles(FileTestCase):
+    def test_existing_files(self):
+        check_input_files(self.write("fixed"), Path(self.write("moving")))
+
+    def test_missing_file(self):
+        missing = os.path.join(self.temp_dir, "moving")
+        with self.assertRaisesRegex(FileNotFoundError, "moving"):
+            check_input_files(self.write("fixed"), missing)
+
+    def test_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            check_input_files(self.temp_dir)
+
+
+class TestCopyNifti(FileTestCase):
+    def test_compresses_uncompressed_source(self):
+        src = self.write("image.nii", b"voxels")
+        dst = os.path.join(self.temp_dir, "copy.nii.gz")
+        copy_nifti(src=src, dst=dst)
+
+        with gzip.open(dst, "rb") as copy:
+            self.assertEqual(copy.read(), b"voxels")
+
+    def test_copies_compressed_source(self):
+        src = self.write("image.nii.gz", gzip.compress(b"voxels"))
+        dst = os.path.join(self.temp_dir, "copy.nii.gz")
+        copy_nifti(src=src, dst=dst)
+
+        self.assertEqual(Path(dst).read_bytes(), Path(src).read_bytes())
+
+
+class TestFastCopy(FileTestCase):
+    def test_copies_content(self):
+        src = self.write("image.nii", b"voxels")
+        dst = os.path.join(self.temp_dir, "copy.nii")
+        fast_copy(src=src, dst=dst)
+
+        self.assertEqual(Path(dst).read_bytes(), b"voxels")
+
+    def test_copy_is_independent(self):
+        src = self.write("image.nii", b"voxels")
+        dst = os.path.join(self.temp_dir, "copy.nii")
+        fast_copy(src=src, dst=dst)
+        Path(dst).write_bytes(b"normalized")
+
+        self.assertEqual(Path(src).read_bytes(), b"voxels")
+
+    def test_replaces_hardlink_to_source(self):
+        src = self.write("image.nii", b"voxels")
+        dst = os.path.join(self.temp_dir, "copy.nii")
+        os.link(src, dst)
+        fast_copy(src=src, dst=dst)
+
+        self.assertFalse(os.path.samefile(src, dst))
+        self.assertEqual(Path(dst).read_bytes(), b"voxels")
+
+    def test_same_path(self):
+        src = self.write("image.nii", b"voxels")
+        fast_copy(src=src, dst=src)
+
+        self.assertEqual(Path(src).read_bytes(), b"voxels")
+
+
+if __name__ == "__main__":
+    unittest.main()